@@ -1,23 +1,27 @@
 import streamlit as st
 import os
+import csv
 import pandas as pd
 import yaml
+import orjson
 import shutil
 import time
-from datetime import datetime, timedelta
-import xml.etree.ElementTree as ET
+import functools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
 
 # Import existing modules
 # We need to add the project root to sys.path if it's not already there for imports to work
 import sys
 sys.path.append(os.getcwd())
 
-from src.ingest import pubmed, downloader
-from src.parse import pubmed_parser, grobid_client, tei_parser
-from src.screen import screener
-from src.rob import assessor
-from src.report import generator
-from src.llm import client as llm_client
+# Pipeline modules (and their requests/openai dependencies) are imported inside the
+# button handlers that use them, so ordinary reruns don't pay for them.
 from src.utils import data_manager
 
 # --- Configuration & Setup ---
@@ -27,6 +31,11 @@ TABLES_DIR = os.path.join(DATA_DIR, "tables")
 TEI_DIR = os.path.join(DATA_DIR, "tei")
 PDF_DIR = os.path.join(DATA_DIR, "pdf")
 CONFIG_PATH = "picos_config.yaml"
+LLM_WORKERS = 4
+PREVIEW_PAGE_ROWS = 200
+EXTRACTION_MAX_CHARS = 8000
+EXTRACTION_SYSTEM_MESSAGE = {"role": "system", "content": "You are a biomedical expert."}
+EXTRACTION_PROMPT_PREFIX = "Extract PICO + Study Design in JSON with keys: population, intervention, comparison, outcome, study_design. Text: "
 
 # Ensure directories exist
 os.makedirs(RAW_DATA_DIR, exist_ok=True)
@@ -37,29 +46,60 @@ os.makedirs(PDF_DIR, exist_ok=True)
 st.set_page_config(page_title="Systematic Reviewer AI", layout="wide")
 
 # --- Helper Functions ---
+@st.cache_data(show_spinner=False)
+def _load_config_cached(path, mtime):
+    # mtime is only part of the cache key: save_config() rewrites the file, which invalidates the entry
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_Loader).get('picos', {})
+
 def load_config():
     if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f).get('picos', {})
+        return _load_config_cached(CONFIG_PATH, os.path.getmtime(CONFIG_PATH))
     return {}
 
 def save_config(picos_data):
     with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        yaml.dump({'picos': picos_data}, f, allow_unicode=True, sort_keys=False)
+        yaml.dump({'picos': picos_data}, f, Dumper=_Dumper, allow_unicode=True, sort_keys=False)
+
+@st.cache_data(show_spinner=False)
+def _read_csv(path, mtime):
+    # Keyed on mtime so any to_csv() back to the same path invalidates the cached frame.
+    # pmid is read as str once here so downstream lookups need no per-call casts.
+    return pd.read_csv(path, dtype={'pmid': str})
+
+def read_articles_csv(path):
+    return _read_csv(path, os.path.getmtime(path))
+
+@st.cache_resource(show_spinner=False)
+def get_llm():
+    # One client (and its HTTP connection pool) shared across reruns and sessions
+    from src.llm import client as llm_client
+    return llm_client.LLMClient(cache_dir=llm_client.LLM_CACHE_DIR)
+
+QUERY_FIELDS = (
+    ('population', '[tiab]'),
+    ('intervention', '[tiab]'),
+    ('comparison', '[tiab]'),
+    ('outcome', '[tiab]'),
+    ('study_design', '[pt]'),
+)
 
 def construct_search_query(picos):
-    query_parts = []
-    def format_part(term, field_tag="[tiab]"):
-        if not term: return None
-        if ' ' in term: return f'"{term}"{field_tag}'
-        return f'{term}{field_tag}'
-
-    query_parts.append(format_part(picos.get('population')))
-    query_parts.append(format_part(picos.get('intervention')))
-    query_parts.append(format_part(picos.get('comparison')))
-    query_parts.append(format_part(picos.get('outcome')))
-    query_parts.append(format_part(picos.get('study_design'), "[pt]"))
-    return " AND ".join(filter(None, query_parts))
+    parts = [(f'"{term}"{tag}' if ' ' in term else f'{term}{tag}') for key, tag in QUERY_FIELDS if (term := picos.get(key))]
+    # Exclude future-dated (ahead-of-print) records at search time instead of filtering the XML afterwards
+    parts.append(f"1800:{datetime.now().year}[dp]")
+    return " AND ".join(parts)
+
+@functools.lru_cache(maxsize=16)
+def cached_search_query(picos_items):
+    # picos_items is tuple(sorted(picos.items())) so the dict can serve as a hashable cache key
+    return construct_search_query(dict(picos_items))
+
+def search_query(picos):
+    try:
+        return cached_search_query(tuple(sorted(picos.items())))
+    except TypeError: # An unhashable value, e.g. a YAML list of synonyms, can't be a cache key
+        return construct_search_query(picos)
 
 # --- Translations ---
 TRANSLATIONS = {
@@ -88,6 +128,7 @@ TRANSLATIONS = {
         "screening_progress": "AI is screening titles and abstracts...",
         "screening_results": "Screening Results",
         "inclusion_rate": "Inclusion Rate",
+        "show_more": "Show more ({shown} / {total} rows)",
         "step3_header": "Step 3: Processing Pipeline",
         "step3_desc": "This step will perform PDF Download, Parsing, RoB Assessment, and Data Extraction.",
         "screen_first_warning": "Please complete screening in Step 2 first.",
@@ -134,6 +175,7 @@ TRANSLATIONS = {
         "screening_progress": "AI가 제목과 초록을 스크리닝하고 있습니다...",
         "screening_results": "스크리닝 결과",
         "inclusion_rate": "포함 비율",
+        "show_more": "더 보기 ({shown} / {total}행)",
         "step3_header": "3단계: 처리 파이프라인",
         "step3_desc": "이 단계에서는 PDF 다운로드, 파싱, 비뚤림 위험(RoB) 평가, 데이터 추출을 수행합니다.",
         "screen_first_warning": "2단계에서 스크리닝을 먼저 완료해주세요.",
@@ -158,11 +200,9 @@ TRANSLATIONS = {
 }
 
 def t(key, **kwargs):
-    lang = st.session_state.get('lang', 'KO') # Default to Korean as requested
-    text = TRANSLATIONS[lang].get(key, key)
-    if kwargs:
-        return text.format(**kwargs)
-    return text
+    # '_tr' holds a reference to the active language's dict, refreshed when the language changes
+    text = st.session_state['_tr'].get(key, key)
+    return text.format(**kwargs) if kwargs else text
 
 def init_session_state():
     if 'stats' not in st.session_state:
@@ -172,7 +212,267 @@ def init_session_state():
     if 'picos' not in st.session_state:
         st.session_state['picos'] = load_config()
     if 'lang' not in st.session_state:
-        st.session_state['lang'] = 'KO'
+        st.session_state['lang'] = 'KO' # Default to Korean as requested
+    if '_tr' not in st.session_state:
+        st.session_state['_tr'] = TRANSLATIONS[st.session_state['lang']]
+
+def rerun_app(message=None):
+    # Tabs are fragments, so state they change (articles.csv, picos) only reaches the sidebar
+    # and other tabs after a full rerun; the message is shown once at the top of that run.
+    if message:
+        st.session_state['flash'] = message
+    st.rerun(scope="app")
+
+def show_paged_dataframe(df, columns, state_key):
+    # Only the visible slice is serialized to the browser; "show more" grows it a page at a time
+    limit = st.session_state.get(state_key, PREVIEW_PAGE_ROWS)
+    st.dataframe(df[columns].head(limit), use_container_width=True)
+    if len(df) > limit:
+        if st.button(t("show_more", shown=limit, total=len(df)), key=f"{state_key}_more"):
+            st.session_state[state_key] = limit + PREVIEW_PAGE_ROWS
+            st.rerun(scope="fragment")
+
+# --- Tab 1: PICO & Search ---
+@st.fragment
+def render_search_tab():
+    st.header(t("step1_header"))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        population = st.text_input(t("population"), value=st.session_state['picos'].get('population', ''))
+        intervention = st.text_input(t("intervention"), value=st.session_state['picos'].get('intervention', ''))
+        comparison = st.text_input(t("comparison"), value=st.session_state['picos'].get('comparison', ''))
+    with col2:
+        outcome = st.text_input(t("outcome"), value=st.session_state['picos'].get('outcome', ''))
+        study_design = st.text_input(t("study_design"), value=st.session_state['picos'].get('study_design', ''))
+
+    if st.button(t("save_config")):
+        new_picos = {
+            'population': population, 'intervention': intervention, 
+            'comparison': comparison, 'outcome': outcome, 'study_design': study_design
+        }
+        save_config(new_picos)
+        st.session_state['picos'] = new_picos
+        rerun_app(t("config_saved"))
+
+    query = search_query(st.session_state['picos'])
+    st.text_area(t("generated_query"), value=query, height=100)
+
+    st.divider()
+    col_s1, col_s2 = st.columns([1, 2])
+    with col_s1:
+        max_ret = st.number_input(t("max_articles"), min_value=1, max_value=1000, value=20)
+    with col_s2:
+        st.markdown("<br>", unsafe_allow_html=True) # Spacer
+        if st.button(t("search_button")):
+            from src.ingest import pubmed
+            from src.parse import pubmed_parser
+            with st.spinner(t("searching")):
+                start_date, end_date = pubmed.search_date_range(years=20)
+
+                # 1. Get PMIDs and total count in a single search. The result set stays on NCBI's
+                # history server, so EFetch pages through it instead of uploading the PMIDs again.
+                search = pubmed.search_history(query, max_ret=max_ret, mindate=start_date, maxdate=end_date, sort='relevance')
+                pmids, total_count = (search['pmids'], search['count']) if search else ([], 0)
+                st.session_state['stats']['total_found'] = total_count
+
+                if total_count > 0:
+                    st.info(t("total_found", count=total_count, max=max_ret))
+
+                    # Save PMIDs
+                    pd.DataFrame(pmids, columns=["pmid"]).to_csv(os.path.join(TABLES_DIR, "retrieved_pmids.csv"), index=False)
+
+                    # Fetch Abstracts. Future-dated records are already excluded by the [dp] clause
+                    # in the query, so the EFetch output goes straight to disk with no year filter.
+                    xml_path = os.path.join(RAW_DATA_DIR, "articles.xml")
+                    if pubmed.fetch_abstracts(history=search, max_ret=max_ret, output_path=xml_path):
+                        # Parse to CSV streaming from the saved file, one <PubmedArticle> at a time
+                        article_count = pubmed_parser.parse_and_save_articles_csv(xml_path, os.path.join(TABLES_DIR, "articles.csv"))
+                        rerun_app(t("retrieval_success", count=article_count))
+                    else:
+                        st.warning(t("no_articles"))
+                else:
+                    st.warning(t("no_articles"))
+
+# --- Tab 2: Screening ---
+@st.fragment
+def render_screening_tab():
+    st.header(t("step2_header"))
+    csv_path = os.path.join(TABLES_DIR, "articles.csv")
+
+    if os.path.exists(csv_path):
+        df = read_articles_csv(csv_path)
+        show_paged_dataframe(df, ['pmid', 'title', 'journal', 'pub_year'], 'articles_rows')
+
+        if st.button(t("start_screening")):
+            from src.screen import screener
+            with st.spinner(t("screening_progress")):
+                screened_df = screener.screen_abstracts(df, st.session_state['picos'])
+
+                # Save results, then copy the bytes for the screening snapshot instead of encoding the frame twice
+                screened_df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+                shutil.copyfile(csv_path, os.path.join(TABLES_DIR, "screening_results.csv"))
+
+                # Update stats
+                st.session_state['stats']['screened'] = len(screened_df)
+                st.session_state['stats']['included'] = int((screened_df['screening_decision'].to_numpy() == 'Included').sum())
+                st.session_state['stats']['excluded'] = st.session_state['stats']['screened'] - st.session_state['stats']['included']
+                rerun_app()
+
+        # Show Screening Results if available
+        if 'screening_decision' in df.columns:
+            st.divider()
+            st.subheader(t("screening_results"))
+            st.metric(t("inclusion_rate"), f"{st.session_state['stats']['included']} / {st.session_state['stats']['screened']}")
+            show_paged_dataframe(df, ['pmid', 'title', 'screening_decision', 'screening_reason'], 'screening_rows')
+    else:
+        st.info(t("search_first"))
+
+# --- Tab 3: Analysis Pipeline ---
+@st.fragment
+def render_pipeline_tab():
+    st.header(t("step3_header"))
+    st.markdown(t("step3_desc"))
+
+    csv_path = os.path.join(TABLES_DIR, "articles.csv")
+    if os.path.exists(csv_path):
+         df = read_articles_csv(csv_path)
+         if 'screening_decision' not in df.columns:
+             st.warning(t("screen_first_warning"))
+         else:
+             included_pmids = df.loc[df['screening_decision'].to_numpy() == 'Included', 'pmid'].tolist()
+
+             if not included_pmids:
+                 st.warning(t("no_included"))
+             else:
+                 if st.button(t("run_pipeline")):
+                     from src.ingest import downloader
+                     from src.parse import grobid_client, tei_parser
+                     from src.rob import assessor
+                     from src.llm import client as llm_client
+                     progress_bar = st.progress(0)
+                     status_text = st.empty()
+                     xml_path = os.path.join(RAW_DATA_DIR, "articles.xml")
+
+                     # 1. Download PDFs
+                     status_text.text(t("downloading_pdfs"))
+                     if 'pmcid' in df.columns:
+                         # articles.csv already has the download IDs, so skip re-parsing articles.xml
+                         included_articles = df.loc[df['pmid'].isin(included_pmids), ['pmid', 'doi', 'pmcid']].fillna('').to_dict('records')
+                         pdf_download_status = downloader.download_pdfs(included_articles, PDF_DIR)
+                     else:
+                         pdf_download_status = downloader.download_pdfs_from_xml(xml_path, PDF_DIR, allowed_pmids=frozenset(included_pmids))
+                     df['pdf_download_status'] = df['pmid'].map(pdf_download_status)
+                     df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+
+                     downloaded_pdfs = {k for k, v in pdf_download_status.items() if "Downloaded" in v or "Already" in v}
+                     st.session_state['stats']['retrieved'] = len(downloaded_pdfs)
+                     progress_bar.progress(25)
+
+                     # 2. GROBID Parsing
+                     status_text.text(t("parsing_pdfs"))
+                     # List PDF_DIR once instead of stat-ing every expected file
+                     pdf_set = set(os.listdir(PDF_DIR))
+                     # GROBID handles concurrent clients, so process_pdfs overlaps the HTTP round-trips
+                     pdf_pmids = {
+                         os.path.join(PDF_DIR, f"{pmid}.pdf"): pmid
+                         for pmid in downloaded_pdfs
+                         if f"{pmid}.pdf" in pdf_set
+                     }
+                     for done, (pdf_path, tei_xml) in enumerate(grobid_client.process_pdfs(pdf_pmids), start=1):
+                         if tei_xml:
+                             with open(os.path.join(TEI_DIR, f"{pdf_pmids[pdf_path]}.xml"), 'wb') as f:
+                                 f.write(tei_xml)
+                         progress_bar.progress(25 + 25 * done // len(pdf_pmids))
+                     progress_bar.progress(50)
+
+                     # 3. RoB Assessment
+                     status_text.text(t("assessing_rob"))
+                     tei_files = [e.name for e in os.scandir(TEI_DIR) if e.name.endswith('.xml')]
+                     if tei_files:
+                         assessor.batch_assess_rob(TEI_DIR, os.path.join(TABLES_DIR, "rob_assessment.csv"))
+                     progress_bar.progress(75)
+
+                     # 4. Data Extraction
+                     status_text.text(t("extracting_data"))
+                     llm = get_llm()
+                     extracted_data = []
+
+                     if tei_files:
+                        tei_pmids = [f.replace('.xml', '') for f in tei_files]
+                        with ThreadPoolExecutor(max_workers=LLM_WORKERS) as ex:
+                            full_texts = ex.map(tei_parser.extract_text_from_tei, [os.path.join(TEI_DIR, f) for f in tei_files])
+                            jobs = []
+                            for pmid, full_text in zip(tei_pmids, full_texts):
+                                if full_text:
+                                    # Single join: no intermediate snippet + '...' copy of the prefix
+                                    user_prompt = ''.join((EXTRACTION_PROMPT_PREFIX, full_text[:EXTRACTION_MAX_CHARS], '...' if len(full_text) > EXTRACTION_MAX_CHARS else ''))
+                                    messages = [EXTRACTION_SYSTEM_MESSAGE, {"role": "user", "content": user_prompt}]
+                                    jobs.append((pmid, messages))
+
+                            # Keep the pool small so a local Ollama server is not saturated
+                            futures = {ex.submit(llm.get_completion, messages, response_format=llm_client.JSON_OBJECT): pmid for pmid, messages in jobs}
+                            for future in as_completed(futures):
+                                pmid = futures[future]
+                                resp = future.result()
+                                # Simple parsing attempt (reuse logic from main.py or make robust later)
+                                try:
+                                    start, end = resp.find('{'), resp.rfind('}')
+                                    if start != -1 and end > start:
+                                        data = orjson.loads(resp[start:end + 1])
+                                        data['pmid'] = pmid
+                                        extracted_data.append(data)
+                                except (orjson.JSONDecodeError, AttributeError, TypeError): pass
+
+                        if extracted_data:
+                            # Rows are heterogeneous dicts; csv.DictWriter fills missing keys without building a DataFrame
+                            fieldnames = list(dict.fromkeys(key for row in extracted_data for key in row))
+                            with open(os.path.join(TABLES_DIR, "extracted_pico.csv"), 'w', encoding='utf-8', newline='') as f:
+                                writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+                                writer.writeheader()
+                                writer.writerows(extracted_data)
+
+                     progress_bar.progress(100)
+                     status_text.text(t("pipeline_complete"))
+                     st.success(t("analysis_complete"))
+
+# --- Tab 4: Reporting ---
+@st.fragment
+def render_report_tab():
+    st.header(t("step4_header"))
+
+    current_lang = st.session_state['lang']
+    report_filename = f"report_{current_lang}.md"
+    report_path = os.path.join(DATA_DIR, report_filename)
+
+    if st.button(t("generate_report")):
+        from src.report import generator
+        generator.generate_report(
+            st.session_state['stats'], 
+            st.session_state['picos'], 
+            os.path.join(TABLES_DIR, "extracted_pico.csv"), 
+            os.path.join(TABLES_DIR, "rob_assessment.csv"), 
+            report_path,
+            lang=current_lang
+        )
+        st.success(t("report_generated"))
+
+    # Display report if it exists for the current language
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report_content = f.read()
+            st.markdown(report_content)
+
+            st.download_button(
+                label=t("download_report"),
+                data=report_content,
+                file_name=report_filename,
+                mime="text/markdown"
+            )
+    else:
+        # If current language report doesn't exist but the OTHER one does?
+        # Optional: Check for fallback. But for now, just strictly follow the toggle.
+        pass
 
 # --- Main App Interface ---
 def main():
@@ -186,10 +486,13 @@ def main():
             index=0 if st.session_state['lang'] == 'KO' else 1,
             horizontal=True
         )
+        st.session_state['_tr'] = TRANSLATIONS[st.session_state['lang']]
         st.divider()
 
     st.title(t("title"))
     st.markdown(t("subtitle"))
+    if 'flash' in st.session_state:
+        st.success(st.session_state.pop('flash'))
 
     # --- Sidebar Content ---
     with st.sidebar:
@@ -208,232 +511,17 @@ def main():
     # --- Tabs ---
     tab1, tab2, tab3, tab4 = st.tabs(t("tabs"))
 
-    # --- Tab 1: PICO & Search ---
     with tab1:
-        st.header(t("step1_header"))
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            population = st.text_input(t("population"), value=st.session_state['picos'].get('population', ''))
-            intervention = st.text_input(t("intervention"), value=st.session_state['picos'].get('intervention', ''))
-            comparison = st.text_input(t("comparison"), value=st.session_state['picos'].get('comparison', ''))
-        with col2:
-            outcome = st.text_input(t("outcome"), value=st.session_state['picos'].get('outcome', ''))
-            study_design = st.text_input(t("study_design"), value=st.session_state['picos'].get('study_design', ''))
-        
-        if st.button(t("save_config")):
-            new_picos = {
-                'population': population, 'intervention': intervention, 
-                'comparison': comparison, 'outcome': outcome, 'study_design': study_design
-            }
-            save_config(new_picos)
-            st.session_state['picos'] = new_picos
-            st.success(t("config_saved"))
-
-        query = construct_search_query(st.session_state['picos'])
-        st.text_area(t("generated_query"), value=query, height=100)
-
-        st.divider()
-        col_s1, col_s2 = st.columns([1, 2])
-        with col_s1:
-            max_ret = st.number_input(t("max_articles"), min_value=1, max_value=1000, value=20)
-        with col_s2:
-            st.markdown("<br>", unsafe_allow_html=True) # Spacer
-            if st.button(t("search_button")):
-                with st.spinner(t("searching")):
-                    today = datetime.now()
-                    end_date = today.strftime("%Y/%m/%d")
-                    start_date = (today - timedelta(days=20*365)).strftime("%Y/%m/%d")
-                    
-                    # 1. Get Count
-                    _, total_count = pubmed.fetch_pmids(query, max_ret=1, mindate=start_date, maxdate=end_date, sort='relevance')
-                    st.session_state['stats']['total_found'] = total_count
-                    
-                    if total_count > 0:
-                        st.info(t("total_found", count=total_count, max=max_ret))
-                        # 2. Get Data
-                        pmids, _ = pubmed.fetch_pmids(query, max_ret=max_ret, mindate=start_date, maxdate=end_date, sort='relevance')
-                        
-                        # Save PMIDs
-                        pd.DataFrame(pmids, columns=["pmid"]).to_csv(os.path.join(TABLES_DIR, "retrieved_pmids.csv"), index=False)
-                        
-                        # Fetch Abstracts
-                        articles_xml = pubmed.fetch_abstracts(pmids)
-                        
-                        # Filter by Year
-                        root = ET.fromstring(articles_xml)
-                        filtered_articles_elements = []
-                        current_year = datetime.now().year
-                        for article in root.findall(".//PubmedArticle"):
-                            pub_year_node = article.find(".//PubDate/Year")
-                            pub_year = int(pub_year_node.text) if pub_year_node is not None and pub_year_node.text.isdigit() else current_year + 1
-                            if pub_year <= current_year:
-                                filtered_articles_elements.append(article)
-                        
-                        # Reconstruct XML
-                        filtered_root = ET.Element("PubmedArticleSet")
-                        for article_elem in filtered_articles_elements:
-                            filtered_root.append(article_elem)
-                        filtered_articles_xml = ET.tostring(filtered_root, encoding='unicode')
-                        
-                        # Save XML
-                        with open(os.path.join(RAW_DATA_DIR, "articles.xml"), 'w', encoding='utf-8') as f:
-                            f.write(filtered_articles_xml)
-                        
-                        # Parse to CSV
-                        pubmed_parser.parse_and_save_articles_csv(filtered_articles_xml, os.path.join(TABLES_DIR, "articles.csv"))
-                        st.success(t("retrieval_success", count=len(filtered_articles_elements)))
-                    else:
-                        st.warning(t("no_articles"))
+        render_search_tab()
 
-    # --- Tab 2: Screening ---
     with tab2:
-        st.header(t("step2_header"))
-        csv_path = os.path.join(TABLES_DIR, "articles.csv")
-        
-        if os.path.exists(csv_path):
-            df = pd.read_csv(csv_path)
-            st.dataframe(df[['pmid', 'title', 'journal', 'pub_year']], use_container_width=True)
-            
-            if st.button(t("start_screening")):
-                with st.spinner(t("screening_progress")):
-                    screened_df = screener.screen_abstracts(df, st.session_state['picos'])
-                    
-                    # Save results
-                    screened_df.to_csv(os.path.join(TABLES_DIR, "screening_results.csv"), index=False, encoding='utf-8-sig')
-                    # Update main csv
-                    screened_df.to_csv(csv_path, index=False, encoding='utf-8-sig')
-                    
-                    # Update stats
-                    st.session_state['stats']['screened'] = len(screened_df)
-                    st.session_state['stats']['included'] = len(screened_df[screened_df['screening_decision'] == 'Included'])
-                    st.session_state['stats']['excluded'] = st.session_state['stats']['screened'] - st.session_state['stats']['included']
-            
-            # Show Screening Results if available
-            if 'screening_decision' in df.columns:
-                st.divider()
-                st.subheader(t("screening_results"))
-                st.metric(t("inclusion_rate"), f"{st.session_state['stats']['included']} / {st.session_state['stats']['screened']}")
-                st.dataframe(df[['pmid', 'title', 'screening_decision', 'screening_reason']], use_container_width=True)
-        else:
-            st.info(t("search_first"))
-
-    # --- Tab 3: Analysis Pipeline ---
+        render_screening_tab()
+
     with tab3:
-        st.header(t("step3_header"))
-        st.markdown(t("step3_desc"))
-        
-        csv_path = os.path.join(TABLES_DIR, "articles.csv")
-        if os.path.exists(csv_path):
-             df = pd.read_csv(csv_path)
-             if 'screening_decision' not in df.columns:
-                 st.warning(t("screen_first_warning"))
-             else:
-                 included_df = df[df['screening_decision'] == 'Included']
-                 included_pmids = included_df['pmid'].astype(str).tolist()
-                 
-                 if not included_pmids:
-                     st.warning(t("no_included"))
-                 else:
-                     if st.button(t("run_pipeline")):
-                         progress_bar = st.progress(0)
-                         status_text = st.empty()
-                         xml_path = os.path.join(RAW_DATA_DIR, "articles.xml")
-
-                         # 1. Download PDFs
-                         status_text.text(t("downloading_pdfs"))
-                         pdf_download_status = downloader.download_pdfs_from_xml(xml_path, PDF_DIR, allowed_pmids=included_pmids)
-                         df['pdf_download_status'] = df['pmid'].astype(str).map(pdf_download_status)
-                         df.to_csv(csv_path, index=False, encoding='utf-8-sig')
-                         
-                         downloaded_pdfs = [k for k, v in pdf_download_status.items() if "Downloaded" in v or "Already" in v]
-                         st.session_state['stats']['retrieved'] = len(downloaded_pdfs)
-                         progress_bar.progress(25)
-                         
-                         # 2. GROBID Parsing
-                         status_text.text(t("parsing_pdfs"))
-                         for pmid in downloaded_pdfs:
-                             pdf_path = os.path.join(PDF_DIR, f"{pmid}.pdf")
-                             if os.path.exists(pdf_path):
-                                 tei_xml = grobid_client.process_pdf(pdf_path)
-                                 if tei_xml:
-                                     with open(os.path.join(TEI_DIR, f"{pmid}.xml"), 'w', encoding='utf-8') as f:
-                                         f.write(tei_xml)
-                         progress_bar.progress(50)
-
-                         # 3. RoB Assessment
-                         status_text.text(t("assessing_rob"))
-                         if os.path.exists(TEI_DIR) and os.listdir(TEI_DIR):
-                             assessor.batch_assess_rob(TEI_DIR, os.path.join(TABLES_DIR, "rob_assessment.csv"))
-                         progress_bar.progress(75)
-
-                         # 4. Data Extraction
-                         status_text.text(t("extracting_data"))
-                         llm = llm_client.LLMClient()
-                         tei_files = [f for f in os.listdir(TEI_DIR) if f.endswith('.xml')]
-                         extracted_data = []
-                         
-                         if tei_files:
-                            for tei_file in tei_files:
-                                pmid = tei_file.replace('.xml', '')
-                                full_text = tei_parser.extract_text_from_tei(os.path.join(TEI_DIR, tei_file))
-                                if full_text:
-                                    text_snippet = (full_text[:8000] + '...') if len(full_text) > 8000 else full_text
-                                    user_prompt = f"Extract PICO + Study Design in JSON with keys: population, intervention, comparison, outcome, study_design. Text: {text_snippet}"
-                                    messages = [{"role": "system", "content": "You are a biomedical expert."}, {"role": "user", "content": user_prompt}]
-                                    resp = llm.get_completion(messages)
-                                    # Simple parsing attempt (reuse logic from main.py or make robust later)
-                                    try:
-                                        import re, json
-                                        match = re.search(r"({[\s\S]*})", resp)
-                                        if match:
-                                            data = json.loads(match.group(1))
-                                            data['pmid'] = pmid
-                                            extracted_data.append(data)
-                                    except: pass
-                            
-                            if extracted_data:
-                                pd.DataFrame(extracted_data).to_csv(os.path.join(TABLES_DIR, "extracted_pico.csv"), index=False)
-                         
-                         progress_bar.progress(100)
-                         status_text.text(t("pipeline_complete"))
-                         st.success(t("analysis_complete"))
-
-    # --- Tab 4: Reporting ---
+        render_pipeline_tab()
+
     with tab4:
-        st.header(t("step4_header"))
-        
-        current_lang = st.session_state['lang']
-        report_filename = f"report_{current_lang}.md"
-        report_path = os.path.join(DATA_DIR, report_filename)
-        
-        if st.button(t("generate_report")):
-            generator.generate_report(
-                st.session_state['stats'], 
-                st.session_state['picos'], 
-                os.path.join(TABLES_DIR, "extracted_pico.csv"), 
-                os.path.join(TABLES_DIR, "rob_assessment.csv"), 
-                report_path,
-                lang=current_lang
-            )
-            st.success(t("report_generated"))
-            
-        # Display report if it exists for the current language
-        if os.path.exists(report_path):
-            with open(report_path, 'r', encoding='utf-8') as f:
-                report_content = f.read()
-                st.markdown(report_content)
-                
-                st.download_button(
-                    label=t("download_report"),
-                    data=report_content,
-                    file_name=report_filename,
-                    mime="text/markdown"
-                )
-        else:
-            # If current language report doesn't exist but the OTHER one does?
-            # Optional: Check for fallback. But for now, just strictly follow the toggle.
-            pass
+        render_report_tab()
 
 if __name__ == "__main__":
     main()
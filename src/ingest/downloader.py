@@ -1,44 +1,164 @@
 import os
+import orjson
 import requests
-import xml.etree.ElementTree as ET
+from lxml import etree
 import time
+import sqlite3
+import threading
+from contextlib import closing
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as RawReadError
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+
+DOWNLOAD_MAX_WORKERS = 8 # Articles downloaded concurrently
+DOWNLOAD_CHUNK_SIZE = 1 << 20 # Bytes per read/write while streaming a PDF to disk
+MAX_PDF_BYTES = 50 * 1024 * 1024 # Larger payloads are not article PDFs worth fetching
+PDF_CONTENT_TYPES = ('application/pdf', 'application/octet-stream') # Some hosts serve PDFs as generic binary
+HOST_MIN_INTERVAL = 1 / 3 # At most ~3 requests/s per host (NCBI's limit without an API key)
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY")
+NCBI_HOST = "eutils.ncbi.nlm.nih.gov"
+NCBI_MIN_INTERVAL = 1 / 10 if NCBI_API_KEY else HOST_MIN_INTERVAL # 10 requests/s with an API key
+
+CACHE_DIR = os.path.join("data", ".cache") # Cleared together with the other generated data
+UNPAYWALL_CACHE_PATH = os.path.join(CACHE_DIR, "unpaywall.sqlite3")
+UNPAYWALL_CACHE_TTL = 30 * 24 * 3600 # Seconds before a cached DOI lookup is re-queried
+
+# One pooled session shared by all download threads. Rate-limit (429) and transient server
+# errors are retried with backoff (the PMC request is a POST, so every method is retried);
+# once retries run out the last response is returned and handled as before.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(
+    total=3, backoff_factor=0.5, backoff_jitter=0.2, status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=None, raise_on_status=False))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# Compiled once and reused for every article; string() yields '' when the node is missing
+_PMID_XPATH = etree.XPath("string(MedlineCitation/PMID)", smart_strings=False)
+_DOI_XPATH = etree.XPath("string(PubmedData/ArticleIdList/ArticleId[@IdType='doi'])", smart_strings=False)
+_PMC_XPATH = etree.XPath("string(PubmedData/ArticleIdList/ArticleId[@IdType='pmc'])", smart_strings=False)
+
+_host_locks = {}
+_host_last_request = {}
+_host_locks_guard = threading.Lock()
+
+def _throttle(url):
+    """Blocks until the host's minimum interval has passed since the last request to it."""
+    host = urlparse(url).hostname
+    interval = NCBI_MIN_INTERVAL if host == NCBI_HOST else HOST_MIN_INTERVAL
+    with _host_locks_guard:
+        lock = _host_locks.setdefault(host, threading.Lock())
+    with lock:
+        wait = _host_last_request.get(host, 0) + interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _host_last_request[host] = time.monotonic()
+
+def _unpaywall_cache_connect():
+    """
+    Opens the Unpaywall lookup cache. A short-lived connection per call keeps the threads
+    independent and survives the cache directory being deleted between runs.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db = sqlite3.connect(UNPAYWALL_CACHE_PATH, timeout=30)
+    db.execute("CREATE TABLE IF NOT EXISTS unpaywall (doi TEXT PRIMARY KEY, pdf_url TEXT, fetched_at REAL)")
+    return db
+
+def _unpaywall_cache_get(doi):
+    """Returns (hit, pdf_url) for a DOI looked up within UNPAYWALL_CACHE_TTL."""
+    with closing(_unpaywall_cache_connect()) as db:
+        row = db.execute(
+            "SELECT pdf_url FROM unpaywall WHERE doi = ? AND fetched_at > ?",
+            (doi, time.time() - UNPAYWALL_CACHE_TTL)
+        ).fetchone()
+    return (True, row[0]) if row else (False, None)
+
+def _unpaywall_cache_put(doi, pdf_url):
+    """Stores a lookup result; None is stored too, so DOIs without an OA copy are not re-queried."""
+    with closing(_unpaywall_cache_connect()) as db, db:
+        db.execute("INSERT OR REPLACE INTO unpaywall VALUES (?, ?, ?)", (doi, pdf_url, time.time()))
 
 def get_unpaywall_pdf_url(doi):
     """
     Queries the Unpaywall API to find a direct PDF link for a given DOI.
+    Answers (including "no OA copy") are cached in SQLite for UNPAYWALL_CACHE_TTL.
     """
     if not doi:
         return None
     try:
+        hit, pdf_url = _unpaywall_cache_get(doi)
+        if hit:
+            return pdf_url
+
         # Using a more compliant email address as recommended by Unpaywall
         email = "systematic-reviewer-ai@example.com"
         url = f"https://api.unpaywall.org/v2/{doi}?email={email}"
-        response = requests.get(url, timeout=20)
+        _throttle(url)
+        response = SESSION.get(url, timeout=20)
+        if response.status_code == 404:
+            # Unknown DOI: a definite answer, so remember it
+            _unpaywall_cache_put(doi, None)
+            return None
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         if data.get("best_oa_location") and data["best_oa_location"].get("url_for_pdf"):
-            return data["best_oa_location"]["url_for_pdf"]
-    except requests.exceptions.RequestException:
-        # This is expected for non-existent DOIs, so we don't need to be too loud.
+            pdf_url = data["best_oa_location"]["url_for_pdf"]
+        _unpaywall_cache_put(doi, pdf_url)
+        return pdf_url
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError):
+        # Network errors and other failures are not cached, so the next run retries them.
         pass
     except Exception as e:
         print(f"  - An unexpected error occurred while processing DOI {doi} with Unpaywall: {e}")
     return None
 
+def _remove_partial(path):
+    """Deletes a partly written download, if any, ignoring a file that is already gone."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
 def download_pdf_from_url(pdf_url, output_path):
     """
     Downloads a PDF from a URL and saves it to the specified path.
+
+    The response headers are checked before any of the body is read, so landing pages
+    (HTML) and oversized payloads are rejected without downloading them.
     """
     try:
-        response = requests.get(pdf_url, stream=True, timeout=60)
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        _throttle(pdf_url)
+        # Closing the response hands the connection back to the shared pool
+        with SESSION.get(pdf_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type not in PDF_CONTENT_TYPES:
+                print(f"  - Not a PDF ({content_type or 'no Content-Type'}): {pdf_url}")
+                return False
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > MAX_PDF_BYTES:
+                print(f"  - PDF too large ({int(content_length) // (1024 * 1024)} MB): {pdf_url}")
+                return False
+
+            written = 0
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > MAX_PDF_BYTES: # No or wrong Content-Length
+                        break
+                    f.write(chunk)
+            if written > MAX_PDF_BYTES:
+                os.remove(output_path)
+                print(f"  - PDF too large (over {MAX_PDF_BYTES // (1024 * 1024)} MB): {pdf_url}")
+                return False
         return True
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, OSError) as e: # OSError: a failed disk write
         print(f"  - Failed to download PDF from {pdf_url}: {e}")
+        # Don't leave a truncated file behind; it would count as "Already Downloaded" next run
+        _remove_partial(output_path)
     return False
 
 def try_pmc_download(pmcid, output_path, timeout=60):
@@ -56,121 +176,165 @@ def try_pmc_download(pmcid, output_path, timeout=60):
         'rettype': 'pdf',
         'retmode': 'binary'
     }
+    if NCBI_API_KEY:
+        params['api_key'] = NCBI_API_KEY
     try:
-        response = requests.post(fetch_url, data=params, stream=True, timeout=timeout)
-        
-        if 'application/pdf' not in response.headers.get('Content-Type', ''):
-            print(f"  - PMC did not return a PDF. Content-Type: {response.headers.get('Content-Type')}")
-            return False
+        _throttle(fetch_url)
+        # Closing the response hands the connection back to the shared pool, even when
+        # PMC answers with something other than a PDF and the body is never read
+        with SESSION.post(fetch_url, data=params, stream=True, timeout=timeout) as response:
+            if 'application/pdf' not in response.headers.get('Content-Type', ''):
+                print(f"  - PMC did not return a PDF. Content-Type: {response.headers.get('Content-Type')}")
+                return False
 
-        response.raise_for_status()
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            response.raise_for_status()
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > MAX_PDF_BYTES:
+                print(f"  - PMC PDF too large ({int(content_length) // (1024 * 1024)} MB).")
+                return False
+
+            # Read straight from the socket; decode_content still undoes any gzip transfer encoding
+            response.raw.decode_content = True
+            written = 0
+            with open(output_path, 'wb') as f:
+                while chunk := response.raw.read(DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > MAX_PDF_BYTES: # No or wrong Content-Length
+                        break
+                    f.write(chunk)
+            if written > MAX_PDF_BYTES:
+                os.remove(output_path)
+                print(f"  - PMC PDF too large (over {MAX_PDF_BYTES // (1024 * 1024)} MB).")
+                return False
         print(f"  - SUCCESS: Downloaded PDF from PMC.")
         return True
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, RawReadError, OSError) as e:
         print(f"  - Failed to download from PMC: {e}")
+        # Don't leave a truncated file behind; it would count as "Already Downloaded" next run
+        _remove_partial(output_path)
         return False
 
-def download_pdfs_from_xml(xml_path, output_dir, allowed_pmids=None):
+def _download_article(article, i, total_articles, output_dir):
     """
-    Parses a PubMed XML file, extracts DOIs and PMCIDs, and attempts to download open-access PDFs
-    using a fallback strategy (Unpaywall -> PMC).
+    Tries to download the PDF for one article record (Unpaywall, then PMC).
+
+    Returns:
+        tuple: (pmid, download status, whether a PDF is now on disk)
+    """
+    pmid = article.get('pmid') or f"unknown_{i+1}"
+    print(f"\n[{i+1}/{total_articles}] Processing PMID: {pmid}")
+
+    output_filename = os.path.join(output_dir, f"{pmid}.pdf")
+    if os.path.exists(output_filename):
+        print("  - PDF already exists.")
+        return pmid, "Already Downloaded", True
+
+    status = "No OA Source Found"
     
+    # --- Strategy 1: Try Unpaywall ---
+    doi = article.get('doi')
+    if doi:
+        pdf_url = get_unpaywall_pdf_url(doi)
+        if pdf_url:
+            print(f"  - Found Unpaywall OA link for DOI {doi}. Attempting download...")
+            if download_pdf_from_url(pdf_url, output_filename):
+                status = "Downloaded (Unpaywall)"
+    
+    # --- Strategy 2: Try PubMed Central (if Unpaywall failed) ---
+    if status == "No OA Source Found":
+        pmcid = article.get('pmcid')
+        if pmcid and try_pmc_download(pmcid, output_filename):
+            status = "Downloaded (PMC)"
+
+    downloaded = status != "No OA Source Found"
+    if not downloaded:
+        print("  - No open access source found via Unpaywall or PMC.")
+
+    return pmid, status, downloaded
+
+def download_pdfs(articles, output_dir, allowed_pmids=None):
+    """
+    Attempts to download open-access PDFs for already-parsed article records
+    using a fallback strategy (Unpaywall -> PMC).
+
     Args:
-        xml_path (str): Path to the PubMed XML file.
+        articles (list): Dicts with 'pmid', 'doi' and 'pmcid' keys, as returned by
+                         pubmed_parser.parse_articles.
         output_dir (str): Directory to save downloaded PDFs.
-        allowed_pmids (list, optional): List of PMIDs to download. If provided, only articles 
-                                        with PMIDs in this list will be processed.
-                                        
+        allowed_pmids (iterable, optional): PMIDs to download. If provided, only articles 
+                                            with PMIDs in this collection will be processed.
+
     Returns:
         dict: A dictionary of PMID to download status.
     """
     os.makedirs(output_dir, exist_ok=True)
 
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-    except ET.ParseError as e:
-        print(f"Error: Failed to parse XML file at {xml_path}. {e}")
-        return {}
-
-    articles = root.findall(".//PubmedArticle")
-    total_found_xml = len(articles)
-    
     # Filter articles if allowed_pmids is provided
     if allowed_pmids is not None:
         allowed_pmids_set = set(str(p) for p in allowed_pmids)
-        articles_to_process = []
-        for article in articles:
-            pmid_node = article.find(".//PMID")
-            pmid = pmid_node.text if pmid_node is not None else None
-            if pmid and pmid in allowed_pmids_set:
-                articles_to_process.append(article)
-        articles = articles_to_process
-        print(f"Filtered XML from {total_found_xml} to {len(articles)} articles based on screening results.")
+        total_found = len(articles)
+        articles = [article for article in articles if article.get('pmid') in allowed_pmids_set]
+        print(f"Filtered articles from {total_found} to {len(articles)} based on screening results.")
     
     total_articles = len(articles)
     if total_articles == 0:
         return {}
 
     print(f"Attempting to download PDFs for {total_articles} articles using fallback strategy (Unpaywall -> PMC)...")
-    download_status = {}
-    download_count = 0
-    
-    for i, article in enumerate(articles):
-        pmid_node = article.find(".//PMID")
-        pmid = pmid_node.text if pmid_node is not None else f"unknown_{i+1}"
-        print(f"\n[{i+1}/{total_articles}] Processing PMID: {pmid}")
-
-        output_filename = os.path.join(output_dir, f"{pmid}.pdf")
-        if os.path.exists(output_filename):
-            print("  - PDF already exists.")
-            download_status[pmid] = "Already Downloaded"
-            download_count += 1
-            continue
-
-        downloaded = False
-        
-        # --- Strategy 1: Try Unpaywall ---
-        doi_node = article.find(".//ArticleId[@IdType='doi']")
-        doi = doi_node.text if doi_node is not None else None
-        if doi:
-            pdf_url = get_unpaywall_pdf_url(doi)
-            if pdf_url:
-                print(f"  - Found Unpaywall OA link for DOI {doi}. Attempting download...")
-                if download_pdf_from_url(pdf_url, output_filename):
-                    download_status[pmid] = "Downloaded (Unpaywall)"
-                    downloaded = True
-                else:
-                    download_status[pmid] = "Download Failed (Unpaywall)"
-        
-        # --- Strategy 2: Try PubMed Central (if Unpaywall failed) ---
-        if not downloaded:
-            pmc_node = article.find(".//ArticleId[@IdType='pmc']")
-            pmcid = pmc_node.text if pmc_node is not None else None
-            if pmcid:
-                if try_pmc_download(pmcid, output_filename):
-                    download_status[pmid] = "Downloaded (PMC)"
-                    downloaded = True
-                else:
-                    # Don't set a final failure status yet, let the outer block handle it
-                    pass
-        
-        if not downloaded:
-            print("  - No open access source found via Unpaywall or PMC.")
-            download_status[pmid] = "No OA Source Found"
+    # Downloads are network-bound, so articles are processed on a small thread pool.
+    # executor.map keeps the results in article order.
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS) as executor:
+        results = list(executor.map(
+            lambda item: _download_article(item[1], item[0], total_articles, output_dir),
+            enumerate(articles)
+        ))
 
-        if downloaded:
-            download_count += 1
-
-        time.sleep(1) # Be polite to APIs
+    download_status = {pmid: status for pmid, status, _ in results}
+    download_count = sum(1 for _, _, downloaded in results if downloaded)
 
     print(f"\nPDF 다운로드 시도 완료: 총 {total_articles}개 중 {download_count}개 성공 또는 이미 존재.")
     return download_status
 
+def download_pdfs_from_xml(xml_path, output_dir, allowed_pmids=None):
+    """
+    Parses a PubMed XML file, extracts DOIs and PMCIDs, and attempts to download open-access PDFs
+    using a fallback strategy (Unpaywall -> PMC).
+
+    Prefer download_pdfs with the records returned by the CSV parser when they are
+    at hand, which avoids parsing the XML a second time.
+    
+    Args:
+        xml_path (str): Path to the PubMed XML file.
+        output_dir (str): Directory to save downloaded PDFs.
+        allowed_pmids (iterable, optional): PMIDs to download. If provided, only articles 
+                                            with PMIDs in this collection will be processed.
+                                        
+    Returns:
+        dict: A dictionary of PMID to download status.
+    """
+    articles = []
+    try:
+        # Stream the file with libxml2 and keep only the three IDs per article
+        # huge_tree lifts libxml2's per-text-node size limit; the ID table is never used; the DTD
+        # is never fetched and entities are not expanded; recover keeps the articles before a
+        # truncated or malformed tail
+        for _, elem in etree.iterparse(xml_path, events=('end',), tag='PubmedArticle', huge_tree=True, collect_ids=False,
+                                       no_network=True, resolve_entities=False, recover=True):
+            articles.append({
+                'pmid': _PMID_XPATH(elem),
+                'doi': _DOI_XPATH(elem),
+                'pmcid': _PMC_XPATH(elem),
+            })
+            # Free the article and the already-processed siblings so the tree never grows
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        print(f"Error: Failed to parse XML file at {xml_path}. {e}")
+        return {}
+
+    return download_pdfs(articles, output_dir, allowed_pmids=allowed_pmids)
+
 if __name__ == '__main__':
     # This allows the script to be run directly for testing purposes.
     current_dir = os.path.dirname(__file__)
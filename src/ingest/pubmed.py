@@ -1,21 +1,101 @@
 
 import requests
 import time
+import os
+import orjson
+import shutil
+import gzip
+import hashlib
+import tempfile
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as RawReadError
+from urllib3.util.retry import Retry
 
 # Base URL for PubMed E-utilities
 EUTILS_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+EFETCH_BATCH_SIZE = 200 # NCBI recommends at most 200 IDs per EFetch request
+ESEARCH_MAX_RECORDS = 9999 # eSearch returns no PMIDs past the first 10,000; EFetch on a history set has no such cap
+# Optional NCBI API key; with it E-utilities allow 10 requests/s instead of 3
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY")
+EFETCH_MAX_WORKERS = 10 if NCBI_API_KEY else 3
+NCBI_MIN_INTERVAL = 1 / 10 if NCBI_API_KEY else 1 / 3 # Seconds between request starts
+CACHE_DIR = os.path.join("data", ".cache") # Cleared together with the other generated data
+CACHE_COMPRESSLEVEL = 3 # Cached EFetch XML is gzipped; PubMed XML shrinks ~6-10x even at low levels
 
-def fetch_pmids(query, max_ret=100, api_key=None, sort='pub_date', mindate=None, maxdate=None):
+# Shared session so batched requests reuse the same keep-alive connections. Rate-limit (429)
+# and transient server errors are retried with jittered exponential backoff, honouring any
+# Retry-After header; EFetch is a POST but idempotent, so every method is retried. Once
+# retries run out the last response is returned as usual.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(
+    total=6, backoff_factor=0.5, backoff_jitter=0.2, status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=None, raise_on_status=False)))
+
+_ncbi_lock = threading.Lock()
+_ncbi_last_request = 0.0
+
+def _throttle():
     """
-    Fetches a list of PubMed IDs (PMIDs) for a given search query.
-    Returns a tuple: (list of PMIDs, total count of PMIDs found).
+    Spaces E-utilities requests NCBI_MIN_INTERVAL apart. Capping the workers alone is not
+    enough: fast responses would let them exceed the per-second limit and get HTTP 429.
     """
-    print(f"Searching PubMed for query: {query}")
-    search_url = f"{EUTILS_BASE_URL}esearch.fcgi"
+    global _ncbi_last_request
+    with _ncbi_lock:
+        wait = _ncbi_last_request + NCBI_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _ncbi_last_request = time.monotonic()
+
+def _cache_path(suffix, *key_parts):
+    """Returns the cache file path for a request, keyed by a sha256 of its parameters."""
+    key = hashlib.sha256("|".join(str(p) for p in key_parts).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key + suffix)
+
+def _write_cache(cache_path, write):
+    """
+    Writes a cache entry by calling write(f) on a temporary file and renaming it into place,
+    so an interrupted write never leaves a truncated entry that later runs take as a hit.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, cache_path)
+    except BaseException: # Including KeyboardInterrupt
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def search_date_range(years=20):
+    """
+    Returns (mindate, maxdate) strings in E-utilities' YYYY/MM/DD format, covering the
+    last `years` calendar years up to today.
+    """
+    today = date.today()
+    try:
+        start = today.replace(year=today.year - years)
+    except ValueError: # Feb 29 with no matching day in the start year
+        start = today.replace(year=today.year - years, day=28)
+    return start.strftime("%Y/%m/%d"), today.strftime("%Y/%m/%d")
+
+def _esearch_params(query, max_ret, api_key, sort, mindate, maxdate, retstart=0):
+    """Builds the eSearch query parameters shared by fetch_pmids and search_history."""
+    api_key = api_key or NCBI_API_KEY
+    if retstart + max_ret > ESEARCH_MAX_RECORDS:
+        print(f"Note: eSearch lists at most {ESEARCH_MAX_RECORDS} PMIDs; use search_history() with "
+              f"fetch_abstracts(history=...) to fetch records beyond that.")
+        max_ret = max(ESEARCH_MAX_RECORDS - retstart, 0)
     params = {
         'db': 'pubmed',
         'term': query,
         'retmax': max_ret,
+        'retstart': retstart,
         'retmode': 'json',
         'sort': sort,
     }
@@ -26,54 +106,210 @@ def fetch_pmids(query, max_ret=100, api_key=None, sort='pub_date', mindate=None,
         params['datetype'] = 'edat' # Use Entrez Date (date added to PubMed)
         params['mindate'] = mindate
         params['maxdate'] = maxdate
+    return params
+
+def fetch_pmids(query, max_ret=100, api_key=None, sort='pub_date', mindate=None, maxdate=None, retstart=0):
+    """
+    Fetches a list of PubMed IDs (PMIDs) for a given search query.
+    `retstart` skips that many results, so a later page can be fetched without re-reading the first.
+    Returns a tuple: (list of PMIDs, total count of PMIDs found).
+    """
+    print(f"Searching PubMed for query: {query}")
+    search_url = f"{EUTILS_BASE_URL}esearch.fcgi"
+    params = _esearch_params(query, max_ret, api_key, sort, mindate, maxdate, retstart)
 
     try:
-        response = requests.get(search_url, params=params)
+        _throttle()
+        response = SESSION.get(search_url, params=params)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         pmids = data.get('esearchresult', {}).get('idlist', [])
         total_count = int(data.get('esearchresult', {}).get('count', 0)) # Get total count
         print(f"Found {len(pmids)} PMIDs (Total: {total_count}).")
         return pmids, total_count # Return both
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"An error occurred during PubMed search: {e}")
         return [], 0
 
-def fetch_abstracts(pmids, api_key=None):
+def search_history(query, max_ret=20, api_key=None, sort='pub_date', mindate=None, maxdate=None):
     """
-    Fetches abstracts and other metadata for a list of PMIDs.
+    Runs an eSearch with usehistory=y, so the full result set stays on NCBI's history server
+    and fetch_abstracts can page through it by WebEnv/query_key instead of sending PMIDs back.
 
-    Args:
-        pmids (list): A list of PubMed IDs.
-        api_key (str, optional): Your NCBI API key. Defaults to None.
+    The WebEnv expires after a few hours of inactivity, so this search itself is not cached.
+    Only the first ESEARCH_MAX_RECORDS PMIDs can be listed, but fetch_abstracts can page
+    through the whole history set.
 
     Returns:
-        dict: A dictionary where keys are PMIDs and values are article metadata.
+        dict: 'pmids' (the first max_ret IDs), 'count', 'webenv', 'query_key' and the search
+              parameters, or None if the search failed.
     """
-    if not pmids:
-        return {}
+    print(f"Searching PubMed for query: {query}")
+    params = _esearch_params(query, max_ret, api_key, sort, mindate, maxdate)
+    params['usehistory'] = 'y'
+    try:
+        _throttle()
+        response = SESSION.get(f"{EUTILS_BASE_URL}esearch.fcgi", params=params)
+        response.raise_for_status()
+        result = orjson.loads(response.content).get('esearchresult', {})
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        print(f"An error occurred during PubMed search: {e}")
+        return None
 
-    print(f"Fetching details for {len(pmids)} PMIDs...")
+    history = {
+        'pmids': result.get('idlist', []),
+        'count': int(result.get('count', 0)),
+        'webenv': result.get('webenv'),
+        'query_key': result.get('querykey'),
+        'query': query,
+        'sort': sort,
+        'mindate': mindate,
+        'maxdate': maxdate,
+    }
+    print(f"Found {len(history['pmids'])} PMIDs (Total: {history['count']}).")
+    return history
+
+def _post_efetch(batch, api_key=None, stream=False):
+    """
+    POSTs one EFetch request and returns the response. `batch` is either a list of PMIDs
+    or a dict of history parameters (WebEnv, query_key, retstart, retmax).
+    """
     fetch_url = f"{EUTILS_BASE_URL}efetch.fcgi"
-    # Join PMIDs into a comma-separated string
-    id_string = ",".join(pmids)
-    
     params = {
         'db': 'pubmed',
-        'id': id_string,
         'retmode': 'xml', # XML is often more detailed than JSON for abstracts
     }
+    if isinstance(batch, dict):
+        params.update(batch)
+    else:
+        params['id'] = ",".join(batch)
+    api_key = api_key or NCBI_API_KEY
     if api_key:
         params['api_key'] = api_key
-
+    _throttle()
+    response = SESSION.post(fetch_url, data=params, stream=stream) # Use POST for long lists of IDs
     try:
-        response = requests.post(fetch_url, data=params) # Use POST for long lists of IDs
         response.raise_for_status()
-        # Basic XML parsing can be done here, but for robustness, a library like BeautifulSoup or lxml is recommended.
-        # For this initial scaffold, we'll just return the raw XML content.
+    except requests.exceptions.HTTPError:
+        response.close() # A streamed response would otherwise keep its pooled connection checked out
+        raise
+    return response
+
+def _fetch_abstracts_batch(batch, api_key=None):
+    """Returns the raw XML bytes for one batch of PMIDs (or one history page)."""
+    return _post_efetch(batch, api_key).content
+
+def _stream_efetch_to_file(batch, api_key, path):
+    """Streams one EFetch batch to `path` in 1 MiB chunks and returns the path."""
+    with _post_efetch(batch, api_key, stream=True) as response, open(path, 'wb') as f:
+        response.raw.decode_content = True # NCBI gzips the XML; decode it while copying
+        shutil.copyfileobj(response.raw, f, 1 << 20)
+    return path
+
+def _article_set_body(xml_text):
+    """Returns the markup between <PubmedArticleSet ...> and </PubmedArticleSet> (str or bytes)."""
+    if isinstance(xml_text, bytes):
+        open_marker, close_marker, gt, empty = b'<PubmedArticleSet', b'</PubmedArticleSet>', b'>', b''
+    else:
+        open_marker, close_marker, gt, empty = '<PubmedArticleSet', '</PubmedArticleSet>', '>', ''
+    open_tag = xml_text.find(open_marker)
+    if open_tag == -1:
+        return empty
+    body_start = xml_text.find(gt, open_tag) + 1
+    body_end = xml_text.rfind(close_marker)
+    return xml_text[body_start:body_end if body_end != -1 else len(xml_text)]
+
+def fetch_abstracts(pmids=None, api_key=None, output_path=None, history=None, max_ret=None):
+    """
+    Fetches abstracts and other metadata for a list of PMIDs, or for the first `max_ret`
+    results of a search_history() result set.
+
+    Records are requested in batches of EFETCH_BATCH_SIZE over a shared session, a few batches
+    at a time, and the returned <PubmedArticle> records are merged under a single
+    <PubmedArticleSet> root. The merged XML is cached gzipped on disk, keyed by the PMID list
+    (or by the search parameters when paging through a history set).
+
+    Args:
+        pmids (list, optional): A list of PubMed IDs.
+        api_key (str, optional): Your NCBI API key. Defaults to the NCBI_API_KEY environment variable.
+        output_path (str, optional): If given, the XML is written to this file as it arrives
+                                     (a single batch is streamed chunk by chunk) instead of
+                                     being returned as one string.
+        history (dict, optional): A search_history() result. Used instead of `pmids`, so the
+                                  IDs never have to be sent back to NCBI.
+        max_ret (int, optional): Number of history records to fetch. Defaults to all of them.
+
+    Returns:
+        bytes: The raw PubMed XML, undecoded so lxml can read the declared encoding itself
+               (or output_path when writing to disk), or None if a request failed.
+    """
+    if history:
+        total = min(max_ret or history['count'], history['count'])
+        if not total:
+            return {}
+        print(f"Fetching details for {total} PMIDs from the search history...")
+        cache_path = _cache_path('.xml.gz', history['query'], history['mindate'], history['maxdate'], history['sort'], total)
+        batches = [
+            {'WebEnv': history['webenv'], 'query_key': history['query_key'],
+             'retstart': start, 'retmax': min(EFETCH_BATCH_SIZE, total - start)}
+            for start in range(0, total, EFETCH_BATCH_SIZE)
+        ]
+    else:
+        if not pmids:
+            return {}
+        print(f"Fetching details for {len(pmids)} PMIDs...")
+        cache_path = _cache_path('.xml.gz', *pmids)
+        batches = [pmids[i:i + EFETCH_BATCH_SIZE] for i in range(0, len(pmids), EFETCH_BATCH_SIZE)]
+
+    if os.path.exists(cache_path):
+        print("Loaded article details from cache.")
+        if output_path:
+            with gzip.open(cache_path, 'rb') as src, open(output_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            return output_path
+        with gzip.open(cache_path, 'rb') as f:
+            return f.read()
+
+    try:
+        if len(batches) == 1 and output_path:
+            result = _stream_efetch_to_file(batches[0], api_key, output_path)
+        elif len(batches) == 1:
+            result = _fetch_abstracts_batch(batches[0], api_key)
+        elif output_path:
+            # Each worker streams its batch to a part file; the parts are then spliced into
+            # output_path in order, so at most one batch is ever held in memory. The executor
+            # is exited (all workers finished) before the part directory is removed.
+            # NCBI allows 3 requests/s without an API key (10 with one), so cap the requests in flight
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path) or None) as tmp_dir, \
+                    ThreadPoolExecutor(max_workers=EFETCH_MAX_WORKERS) as executor:
+                part_paths = [os.path.join(tmp_dir, f"part{i}.xml") for i in range(len(batches))]
+                parts = executor.map(lambda job: _stream_efetch_to_file(job[0], api_key, job[1]), zip(batches, part_paths))
+                with open(output_path, 'wb') as f:
+                    f.write(b'<?xml version="1.0" ?>\n<PubmedArticleSet>')
+                    for part_path in parts:
+                        with open(part_path, 'rb') as part:
+                            f.write(_article_set_body(part.read()))
+                        os.remove(part_path)
+                    f.write(b'</PubmedArticleSet>')
+            result = output_path
+        else:
+            with ThreadPoolExecutor(max_workers=EFETCH_MAX_WORKERS) as executor:
+                results = executor.map(lambda batch: _fetch_abstracts_batch(batch, api_key), batches)
+                result = b'<?xml version="1.0" ?>\n<PubmedArticleSet>' + b''.join(_article_set_body(r) for r in results) + b'</PubmedArticleSet>'
         print("Successfully fetched article details.")
-        return response.text # In a real implementation, parse this XML
-    except requests.exceptions.RequestException as e:
+
+        def write_gzip(f):
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=CACHE_COMPRESSLEVEL) as dst:
+                if output_path:
+                    with open(output_path, 'rb') as src:
+                        shutil.copyfileobj(src, dst)
+                else:
+                    dst.write(result)
+        # GzipFile writes a valid trailer even when the copy is interrupted, so a truncated
+        # entry would still read as a hit; it only becomes visible once complete
+        _write_cache(cache_path, write_gzip)
+        return result
+    except (requests.exceptions.RequestException, RawReadError) as e:
         print(f"An error occurred during PubMed fetch: {e}")
         return None
 
@@ -83,13 +319,13 @@ if __name__ == '__main__':
     EXAMPLE_QUERY = "('polycystic ovary syndrome':ti,ab OR 'pcos':ti,ab) AND ('herbal':ti,ab OR 'chinese med*':ti,ab) AND 'rando*':ti,ab"
     
     # 1. Fetch PMIDs
-    retrieved_pmids = fetch_pmids(EXAMPLE_QUERY, max_ret=5)
+    retrieved_pmids, _ = fetch_pmids(EXAMPLE_QUERY, max_ret=5)
     
     # 2. Fetch abstracts for the retrieved PMIDs
     if retrieved_pmids:
         article_data_xml = fetch_abstracts(retrieved_pmids)
         if article_data_xml:
             print("\n--- Raw XML Output (first 500 chars) ---")
-            print(article_data_xml[:500] + "...")
+            print(article_data_xml[:500].decode('utf-8', 'replace') + "...")
             print("----------------------------------------\n")
             print("Note: In a full implementation, this XML would be parsed to extract Title, Abstract, Authors, etc.")
@@ -1,24 +1,138 @@
 
 import openai
 import os
+import hashlib
+import tempfile
+import functools
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+LLM_CACHE_DIR = os.path.join("data", ".cache", "llm") # Cleared together with the other generated data
+LLM_CONCURRENCY = 4 # Requests in flight in get_completions; small so a local server is not saturated
+JSON_OBJECT = {"type": "json_object"} # response_format that makes the server emit one valid JSON object
+CHARS_PER_TOKEN = 4 # Estimate used when no tokenizer is available
+AVAILABILITY_TIMEOUT = 5 # Seconds for the model-list health check
+AVAILABILITY_TTL = 60 # Seconds a passed check is trusted before the server is asked again
+
+# Base URL -> time.monotonic() of its last passed is_available check. Failures are not stored,
+# and a connection error during a completion drops the entry
+_available_servers = {}
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    """The shared tiktoken encoding, loaded once; None if tiktoken or its data is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e: # The encoding file is downloaded on first use
+        print(f"Warning: tiktoken encoding unavailable, estimating tokens from characters: {e}")
+        return None
+
+def count_tokens(text):
+    """Approximate token count of text, measured the same way as in truncate_to_tokens."""
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cuts text to at most max_tokens tokens. Returns (text, truncated).
+    Tokens are counted with tiktoken's cl100k_base, an approximation of the local model's
+    tokenizer that, unlike a character count, tracks dense (e.g. CJK) text; without
+    tiktoken, CHARS_PER_TOKEN characters per token are assumed.
+    """
+    if len(text) <= max_tokens: # Every token covers at least one character
+        return text, False
+    encoding = _encoding()
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text[:limit], len(text) > limit
+    # Only a prefix long enough to hold max_tokens tokens is encoded, not the whole paper
+    ids = encoding.encode(text[:max_tokens * 4 * CHARS_PER_TOKEN], disallowed_special=())
+    if len(ids) <= max_tokens and len(text) <= max_tokens * 4 * CHARS_PER_TOKEN:
+        return text, False
+    return encoding.decode(ids[:max_tokens]), True
 
 class LLMClient:
     """
     A client to interact with the local llamafile server, which is compatible
     with the OpenAI API.
     """
-    def __init__(self, base_url="http://127.0.0.1:11434/v1"):
+    def __init__(self, base_url="http://127.0.0.1:11434/v1", cache_dir=None):
         """
         Initializes the OpenAI client to connect to the local server.
         Args:
             base_url (str): The base URL of the local llamafile server.
+            cache_dir (str, optional): If given, replies are cached on disk under this directory,
+                                       keyed by model, temperature and messages, so re-runs
+                                       do not send identical prompts again.
         """
         self.client = openai.OpenAI(
             base_url=base_url,
             api_key="sk-no-key-required"  # API key is not needed for local server
         )
+        self.cache_dir = cache_dir
+        self._memory_cache = {} # In-process tier in front of the disk cache
 
-    def get_completion(self, messages, model="gemma2", temperature=0.7):
+    def _cache_path(self, key):
+        # Fan out over 256 subdirectories so no single directory grows too large
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _cache_get(self, key):
+        if key in self._memory_cache:
+            return self._memory_cache[key]
+        try:
+            with open(self._cache_path(key), 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError:
+            return None
+        self._memory_cache[key] = content
+        return content
+
+    def _cache_put(self, key, content):
+        self._memory_cache[key] = content
+        path = self._cache_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file and rename it, so a concurrent reader never sees a partial reply
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write the LLM cache entry {path}: {e}")
+
+    def is_available(self):
+        """
+        Checks that the server is up by listing its models, which generates nothing, so it
+        returns in milliseconds rather than taking a full completion round trip. A success
+        is trusted for AVAILABILITY_TTL seconds, or until a completion fails to connect, so
+        the long-running Streamlit process notices a server that was stopped; a failure is
+        not remembered, so a server started later is picked up.
+        """
+        base_url = str(self.client.base_url)
+        checked_at = _available_servers.get(base_url)
+        if checked_at is not None and time.monotonic() - checked_at < AVAILABILITY_TTL:
+            return True
+        try:
+            self.client.with_options(timeout=AVAILABILITY_TIMEOUT, max_retries=0).models.list()
+        except openai.OpenAIError:
+            print(f"Error connecting to the Ollama server at {base_url}.")
+            print("Please ensure the Ollama application is running.")
+            return False
+        _available_servers[base_url] = time.monotonic()
+        return True
+
+    def get_completion(self, messages, model="gemma2", temperature=0.7, cache=True,
+                       max_tokens=None, timeout=None, max_retries=None, response_format=None):
         """
         Gets a completion from the local LLM.
 
@@ -27,22 +141,99 @@ class LLMClient:
             model (str): The model name to use. This is required by the API but the
                          actual model is the one running in the llamafile server.
             temperature (float): The sampling temperature.
+            cache (bool): Set to False for calls that must reach the server.
+                          Has no effect without a cache_dir.
+            max_tokens (int, optional): Upper bound on the length of the reply.
+            timeout (float, optional): Seconds before a request is abandoned, so one stuck
+                                       generation cannot stall a whole batch.
+            max_retries (int, optional): Retries (with exponential backoff) on connection
+                                         errors, 429 and 5xx. Defaults to the client's 2.
+            response_format (dict, optional): E.g. JSON_OBJECT to have the server constrain
+                                              the reply to valid JSON (Ollama and llamafile
+                                              both support it).
 
         Returns:
-            str: The content of the assistant's reply.
+            str: The content of the assistant's reply, or None if the server could not be
+                 reached or the request timed out.
         """
+        key = None
+        if cache and self.cache_dir:
+            key = hashlib.sha256(orjson.dumps(
+                {'m': model, 't': temperature, 'n': max_tokens, 'f': response_format, 'msgs': messages},
+                option=orjson.OPT_SORT_KEYS
+            )).hexdigest()
+            content = self._cache_get(key)
+            if content is not None:
+                return content
+
+        client = self.client
+        if timeout is not None or max_retries is not None:
+            client = client.with_options(
+                **{k: v for k, v in (('timeout', timeout), ('max_retries', max_retries)) if v is not None}
+            )
+        extra = {}
+        if max_tokens:
+            extra['max_tokens'] = max_tokens
+        if response_format:
+            extra['response_format'] = response_format
         try:
-            completion = self.client.chat.completions.create(
+            completion = client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
+                **extra,
             )
-            return completion.choices[0].message.content
+            choice = completion.choices[0]
+            content = choice.message.content
+            # A reply cut off at max_tokens is returned but not cached, so a re-run can do better
+            if key and content and choice.finish_reason != 'length':
+                self._cache_put(key, content)
+            return content
+        except openai.APITimeoutError:
+            print(f"LLM request timed out after {timeout or 'the default'} seconds.")
+            return None
         except openai.APIConnectionError as e:
+            _available_servers.pop(str(self.client.base_url), None) # The next is_available() re-checks
             print(f"Error connecting to the Ollama server at {self.client.base_url}.")
             print("Please ensure the Ollama application is running.")
             return None
 
+    def get_completions(self, batch, concurrency=LLM_CONCURRENCY, return_exceptions=False, **kwargs):
+        """
+        Gets completions for several message lists at once. The server overlaps the requests,
+        so N prompts finish in far less than N round trips. Identical message lists (e.g. the
+        same abstract listed twice) are sent once and share the reply.
+
+        Args:
+            batch (list): Message lists, each as accepted by get_completion.
+            concurrency (int): Maximum number of requests in flight.
+            return_exceptions (bool): If True, an exception raised for one message list is
+                                      returned in its place instead of being re-raised.
+            **kwargs: Passed on to get_completion (model, temperature, cache).
+
+        Returns:
+            list: The replies, in the same order as `batch`.
+        """
+        def complete(messages):
+            try:
+                return self.get_completion(messages, **kwargs)
+            except Exception as e:
+                if return_exceptions:
+                    return e
+                raise
+
+        # Concurrent duplicates would all miss the cache, so collapse them before sending
+        unique = {}
+        slots = []
+        for messages in batch:
+            digest = hashlib.blake2b(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+            slots.append(unique.setdefault(digest, (len(unique), messages))[0])
+
+        # The OpenAI client is thread-safe, so the threads share its connection pool
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            replies = list(executor.map(complete, [messages for _, messages in unique.values()]))
+        return [replies[slot] for slot in slots]
+
 if __name__ == '__main__':
     # This is an example of how to use the LLMClient.
     # Make sure your llamafile server is running before executing this.
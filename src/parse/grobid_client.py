@@ -1,9 +1,83 @@
 import os
+import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # The default URL for the GROBID service started with docker-compose
 GROBID_URL = "http://localhost:8070"
 GROBID_API_URL = f"{GROBID_URL}/api/processFulltextDocument"
+GROBID_CONCURRENCY = 10 # PDFs in flight at once; matches the default worker pool of the GROBID image
+
+# Keep-alive session for all PDFs. GROBID answers 503 when its worker pool is busy, so that is
+# retried with backoff; connection errors are not, so a stopped service fails fast.
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_maxsize=GROBID_CONCURRENCY, max_retries=Retry(
+    total=3, connect=0, backoff_factor=1, backoff_jitter=0.2, status_forcelist=[503],
+    allowed_methods=None, raise_on_status=False)))
+
+class _MultipartPdfBody:
+    """
+    A multipart/form-data body with a single file field, read from disk as it is sent.
+
+    Passing the file through `files=` makes requests build the whole multipart body in memory
+    first. This object has a length (so Content-Length is still sent) and supports seek/tell,
+    so urllib3 can rewind it when a 503 is retried.
+    """
+    def __init__(self, field, path, content_type):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self._file_size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._head) + self._file_size + len(self._tail)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self)
+        self._pos = offset
+        self._file.seek(min(max(offset - len(self._head), 0), self._file_size))
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self) - self._pos
+        file_end = len(self._head) + self._file_size
+        chunks = []
+        while size > 0 and self._pos < len(self):
+            if self._pos < len(self._head):
+                chunk = self._head[self._pos:self._pos + size]
+            elif self._pos < file_end:
+                chunk = self._file.read(min(size, file_end - self._pos))
+                if not chunk: # The file shrank after its size was taken
+                    break
+            else:
+                offset = self._pos - file_end
+                chunk = self._tail[offset:offset + size]
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
 
 def process_pdf(pdf_path, timeout=60):
     """
@@ -14,7 +88,8 @@ def process_pdf(pdf_path, timeout=60):
         timeout (int): The timeout for the request in seconds.
 
     Returns:
-        str: The TEI XML as a string if successful, None otherwise.
+        bytes: The TEI XML as returned by GROBID (undecoded, so it can be written or parsed
+               as-is) if successful, None otherwise.
     """
     if not os.path.exists(pdf_path):
         print(f"Error: PDF file not found at {pdf_path}")
@@ -22,17 +97,14 @@ def process_pdf(pdf_path, timeout=60):
 
     print(f"Processing {os.path.basename(pdf_path)} with GROBID...")
     try:
-        with open(pdf_path, 'rb') as f:
-            # Using a simpler dictionary format for the `files` parameter
-            clean_filename = os.path.basename(pdf_path)
-            files = {'input': (clean_filename, f, 'application/pdf')}
-            
+        # The PDF is streamed from disk in blocks instead of being loaded into memory
+        with _MultipartPdfBody('input', pdf_path, 'application/pdf') as body:
             # Make the request to the GROBID server
-            response = requests.post(GROBID_API_URL, files=files, timeout=timeout)
+            response = SESSION.post(GROBID_API_URL, data=body, headers={'Content-Type': body.content_type}, timeout=timeout)
             
             if response.status_code == 200:
                 print("  - Successfully processed by GROBID.")
-                return response.text
+                return response.content
             else:
                 print(f"  - Error processing with GROBID. Status: {response.status_code}, Response: {response.text[:500]}")
                 return None
@@ -41,6 +113,30 @@ def process_pdf(pdf_path, timeout=60):
         print(f"    Is the GROBID service running? Try running 'start_services.bat'.")
         return None
 
+def process_pdfs(pdf_paths, concurrency=GROBID_CONCURRENCY):
+    """
+    Sends several PDFs to GROBID at once. GROBID processes requests in parallel and the client
+    only waits on the HTTP round trip, so up to `concurrency` PDFs are kept in flight.
+
+    Args:
+        pdf_paths (iterable): Paths of the PDF files to process.
+        concurrency (int): Maximum number of PDFs sent at the same time.
+
+    Yields:
+        tuple: (pdf_path, TEI XML bytes or None), in the order the PDFs finish.
+    """
+    def process_one(pdf_path):
+        try:
+            return process_pdf(pdf_path)
+        except Exception as e: # One unreadable PDF must not stop the others
+            print(f"  - Unexpected error processing {os.path.basename(pdf_path)} with GROBID: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(process_one, pdf_path): pdf_path for pdf_path in pdf_paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
 if __name__ == '__main__':
     # This allows the script to be run directly for testing purposes.
     print("--- Testing GROBID Client ---")
@@ -74,7 +170,7 @@ if __name__ == '__main__':
             # Save the output for inspection
             output_filename = os.path.basename(test_pdf_path).replace('.pdf', '.xml')
             output_path = os.path.join(tei_dir, output_filename)
-            with open(output_path, 'w', encoding='utf-8') as f:
+            with open(output_path, 'wb') as f:
                 f.write(tei_xml)
             print(f"\nTest successful. Saved TEI XML output to: {output_path}")
         else:
@@ -1,57 +1,129 @@
-import xml.etree.ElementTree as ET
-import pandas as pd
+import os
+import csv
+from operator import itemgetter
+from lxml import etree
 
-def parse_and_save_articles_csv(xml_string, output_path):
+# Column order of articles.csv
+ARTICLE_FIELDS = ('pmid', 'doi', 'pmcid', 'title', 'journal', 'pub_year', 'abstract')
+_article_row = itemgetter(*ARTICLE_FIELDS)
+
+# libxml2 options for PubMed XML: huge_tree lifts the per-text-node size limit for long abstracts;
+# the ID table is never used; the DTD is never fetched and entities are not expanded (which also
+# rules out XXE); recover keeps the articles before a truncated or malformed tail instead of
+# failing the whole file
+_PARSER_OPTIONS = dict(huge_tree=True, collect_ids=False, no_network=True, resolve_entities=False, recover=True)
+
+# Field lookups compiled once and pinned to their schema paths under <PubmedArticle>, so no
+# descendant scan is needed (and reference lists can never match); string() yields '' when
+# the node is missing
+_PMID_XPATH = etree.XPath("string(MedlineCitation/PMID)", smart_strings=False)
+_DOI_XPATH = etree.XPath("string(PubmedData/ArticleIdList/ArticleId[@IdType='doi'])", smart_strings=False)
+_PMC_XPATH = etree.XPath("string(PubmedData/ArticleIdList/ArticleId[@IdType='pmc'])", smart_strings=False)
+_TITLE_XPATH = etree.XPath("string(MedlineCitation/Article/ArticleTitle)", smart_strings=False)
+_JOURNAL_XPATH = etree.XPath("string(MedlineCitation/Article/Journal/Title)", smart_strings=False)
+_YEAR_XPATH = etree.XPath("string(MedlineCitation/Article/Journal/JournalIssue/PubDate/Year)", smart_strings=False)
+_ABSTRACT_XPATH = etree.XPath("MedlineCitation/Article/Abstract/AbstractText")
+
+def _article_record(article):
+    """Extracts the CSV fields (plus PMCID for the PDF downloader) from one <PubmedArticle>."""
+    # Abstract sections keep the text of inline markup such as <i> and <sup>
+    abstract_parts = (''.join(node.itertext()) for node in _ABSTRACT_XPATH(article))
+    return {
+        'pmid': _PMID_XPATH(article),
+        'doi': _DOI_XPATH(article),
+        'pmcid': _PMC_XPATH(article), # PDF download fallback
+        'title': _TITLE_XPATH(article),
+        'journal': _JOURNAL_XPATH(article),
+        'pub_year': _YEAR_XPATH(article),
+        'abstract': ' '.join(part for part in abstract_parts if part),
+    }
+
+def iter_articles(xml_source):
     """
-    Parses the XML content from PubMed and saves the key information into a CSV file.
+    Yields one record (dict) per <PubmedArticle>, without building a list or writing anything.
+
+    A saved XML file is streamed with lxml's iterparse, one <PubmedArticle> at a time.
 
     Args:
-        xml_string (str): The raw XML string fetched from PubMed.
-        output_path (str): The path to save the output CSV file.
+        xml_source (bytes, str or Element): The raw XML fetched from PubMed (bytes as returned by
+                                            pubmed.fetch_abstracts, or a string), the path to a saved
+                                            XML file, or an already-parsed <PubmedArticleSet> element.
+
+    Raises:
+        etree.XMLSyntaxError: If the XML cannot be parsed at all.
     """
-    try:
-        root = ET.fromstring(xml_string)
-    except ET.ParseError as e:
-        print(f"Error: Failed to parse XML string. {e}")
+    if isinstance(xml_source, str) and os.path.isfile(xml_source):
+        for _, elem in etree.iterparse(xml_source, events=('end',), tag='PubmedArticle', **_PARSER_OPTIONS):
+            yield _article_record(elem)
+            # Free the article and the already-processed siblings so the tree never grows
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
         return
 
-    articles_list = []
-    for article in root.findall(".//PubmedArticle"):
-        article_data = {}
+    if isinstance(xml_source, (str, bytes)):
+        # lxml refuses str input that carries an encoding declaration, so hand it bytes
+        if isinstance(xml_source, str):
+            xml_source = xml_source.encode('utf-8')
+        parser = etree.XMLParser(**_PARSER_OPTIONS)
+        root = etree.fromstring(xml_source, parser=parser)
+    else:
+        root = xml_source
+    if root is not None: # recover yields no root for input with no usable markup
+        for article in root.iter('PubmedArticle'):
+            yield _article_record(article)
 
-        # Extract PMID
-        pmid_node = article.find(".//PMID")
-        article_data['pmid'] = pmid_node.text if pmid_node is not None else ''
+def parse_articles(xml_source):
+    """
+    Parses the XML content from PubMed into one record (dict) per article, without writing anything.
+
+    Args:
+        xml_source (bytes, str or Element): Anything iter_articles accepts.
 
-        # Extract DOI
-        doi_node = article.find(".//ArticleId[@IdType='doi']")
-        article_data['doi'] = doi_node.text if doi_node is not None else ''
+    Returns:
+        list: The parsed article records. They include 'doi' and 'pmcid', so they can be
+              passed to downloader.download_pdfs without re-reading the XML.
+    """
+    try:
+        articles_list = list(iter_articles(xml_source))
+    except etree.XMLSyntaxError as e:
+        print(f"Error: Failed to parse XML. {e}")
+        return []
 
-        # Extract Title
-        title_node = article.find(".//ArticleTitle")
-        article_data['title'] = title_node.text if title_node is not None else ''
+    if not articles_list:
+        print("No articles found in the XML to process.")
+    return articles_list
 
-        # Extract Journal Title
-        journal_title_node = article.find(".//Journal/Title")
-        article_data['journal'] = journal_title_node.text if journal_title_node is not None else ''
+def parse_and_save_articles_csv(xml_source, output_path):
+    """
+    Parses the XML content from PubMed and saves the key information into a CSV file.
 
-        # Extract Publication Year
-        pub_year_node = article.find(".//PubDate/Year")
-        article_data['pub_year'] = pub_year_node.text if pub_year_node is not None else ''
+    Each article is written as soon as it is parsed, so no record list or DataFrame is built.
 
-        # Extract Abstract
-        abstract_nodes = article.findall(".//Abstract/AbstractText")
-        abstract_text = ' '.join([node.text for node in abstract_nodes if node.text])
-        article_data['abstract'] = abstract_text
+    Args:
+        xml_source (bytes, str or Element): Anything iter_articles accepts.
+        output_path (str): The path to save the output CSV file.
 
-        articles_list.append(article_data)
+    Returns:
+        int: The number of articles written. No file is left behind when there are none.
+    """
+    count = 0
+    try:
+        # Use utf-8-sig for better compatibility with Excel
+        with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(ARTICLE_FIELDS)
+            for record in iter_articles(xml_source):
+                writer.writerow(_article_row(record))
+                count += 1
+    except etree.XMLSyntaxError as e:
+        print(f"Error: Failed to parse XML. {e}")
+        count = 0
 
-    if not articles_list:
+    if not count:
+        os.remove(output_path)
         print("No articles found in the XML to process.")
-        return
+        return 0
 
-    # Create DataFrame and save to CSV
-    df = pd.DataFrame(articles_list)
-    # Use utf-8-sig for better compatibility with Excel
-    df.to_csv(output_path, index=False, encoding='utf-8-sig')
-    print(f"Successfully parsed and saved {len(articles_list)} articles to {output_path}")
+    print(f"Successfully parsed and saved {count} articles to {output_path}")
+    return count
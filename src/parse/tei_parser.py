@@ -1,10 +1,20 @@
-import xml.etree.ElementTree as ET
+from lxml import etree
 import os
+import re
+
+_TEI_NS = '{http://www.tei-c.org/ns/1.0}'
+_BODY_TAG = _TEI_NS + 'body'
+_HEADER_TAG = _TEI_NS + 'teiHeader'
+_WHITESPACE_RE = re.compile(r'\s+') # Same characters str.split() breaks on
 
 def extract_text_from_tei(xml_path):
     """
     Parses a TEI XML file and extracts the plain text content from the body.
 
+    The file is streamed with iterparse: each top-level section of the body is turned into
+    text and freed as soon as it is complete, and parsing stops at </body>, so the
+    back matter (references, annexes) is never read.
+
     Args:
         xml_path (str): The path to the TEI XML file.
 
@@ -12,25 +22,40 @@ def extract_text_from_tei(xml_path):
         str: The concatenated plain text content, or an empty string if parsing fails.
     """
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        
-        # Define the TEI namespace
-        ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
-        
-        # Find the body of the text
-        body = root.find('.//tei:body', ns)
-        
-        if body is None:
-            return ""
-            
-        # Iterate through all text nodes in the body and join them
-        text_content = ''.join(body.itertext())
-        
-        # Clean up excessive whitespace and newlines
-        return ' '.join(text_content.split())
+        parts = []
+        # huge_tree lifts libxml2's per-text-node size limit for long full texts; the ID table is
+        # never used; nothing is fetched over the network and entities are not expanded.
+        # Comments and processing instructions are dropped while parsing (their tail text is
+        # merged into the surrounding text), so every child of <body> below is an element
+        for _, elem in etree.iterparse(xml_path, events=('end',), huge_tree=True, collect_ids=False,
+                                       no_network=True, resolve_entities=False,
+                                       remove_comments=True, remove_pis=True):
+            if elem.tag == _BODY_TAG:
+                # The body's leading text, and the tail of its last section, are complete now
+                parts.insert(0, elem.text or '')
+                if len(elem):
+                    parts.append(elem[-1].tail or '')
+                break
+            parent = elem.getparent()
+            if parent is not None and parent.tag == _BODY_TAG:
+                # A tail may still be unread when its element ends, so each section's tail is
+                # taken (and the section dropped) once the next section has ended
+                previous = elem.getprevious()
+                if previous is not None:
+                    parts.append(previous.tail or '')
+                    del parent[0]
+                # Same text, in the same order, as body.itertext() would yield for this section
+                parts.append(''.join(elem.itertext()))
+                elem.clear(keep_tail=True)
+            elif elem.tag == _HEADER_TAG:
+                elem.clear()
+        else:
+            return "" # No body in the document
+
+        # Clean up excessive whitespace and newlines in one pass, without a list of every token
+        return _WHITESPACE_RE.sub(' ', ''.join(parts)).strip()
         
-    except ET.ParseError as e:
+    except etree.XMLSyntaxError as e:
         print(f"Error parsing TEI XML file {xml_path}: {e}")
         return ""
     except Exception as e:
@@ -1,7 +1,9 @@
 import os
-import pandas as pd
+import csv
+import string
 from datetime import datetime
 
+REPORT_PREVIEW_ROWS = 50 # Rows of each result table shown in the report unless full_tables is set
 
 REPORT_TRANSLATIONS = {
     "EN": {
@@ -21,6 +23,7 @@ REPORT_TRANSLATIONS = {
         "rob_header": "5. Risk of Bias Assessment",
         "rob_count": "Assessed {count} studies.",
         "no_rob": "No Risk of Bias assessment available.",
+        "table_truncated": "Showing the first {shown} of {count} rows; see {file} for all of them.",
         "prisma_id": "Identification<br/>Records identified from PubMed",
         "prisma_screened": "Records screened",
         "prisma_excluded": "Records excluded",
@@ -46,6 +49,7 @@ REPORT_TRANSLATIONS = {
         "rob_header": "5. 비뚤림 위험(RoB) 평가",
         "rob_count": "총 {count}개 연구 평가됨.",
         "no_rob": "평가된 RoB 데이터가 없습니다.",
+        "table_truncated": "전체 {count}행 중 처음 {shown}행만 표시합니다. 전체 내용은 {file} 파일을 참고하세요.",
         "prisma_id": "식별(Identification)<br/>PubMed 검색 결과",
         "prisma_screened": "스크리닝(Screening)<br/>검토된 기록",
         "prisma_excluded": "제외됨(Excluded)",
@@ -56,79 +60,140 @@ REPORT_TRANSLATIONS = {
     }
 }
 
+# Mermaid source of the PRISMA flow diagram: the labels ({...}) are filled in once per
+# language at import time, leaving only the counts ($...) for each call
+_PRISMA_MERMAID = """
+```mermaid
+graph TD
+    A[{prisma_id}<br/>(n = $total_found)] --> B[{prisma_screened}<br/>(n = $screened)]
+    B --> C[{prisma_excluded}<br/>(n = $excluded)]
+    B --> D[{prisma_sought}<br/>(n = $included)]
+    D --> E[{prisma_not_retrieved}<br/>(n = $not_retrieved)]
+    D --> F[{prisma_retrieved}<br/>(n = $retrieved)]
+    F --> G[{prisma_included}<br/>(n = $retrieved)]
+```
+"""
+_PRISMA_TEMPLATES = {
+    lang: string.Template(_PRISMA_MERMAID.format(**t)) for lang, t in REPORT_TRANSLATIONS.items()
+}
+
 def generate_prisma_mermaid(stats, lang="EN"):
     """
     Generates a Mermaid JS code for PRISMA flow diagram.
     """
     s = stats
-    t = REPORT_TRANSLATIONS.get(lang, REPORT_TRANSLATIONS["EN"])
-    
-    mermaid_code = f"""
-```mermaid
-graph TD
-    A[{t['prisma_id']}<br/>(n = {s.get('total_found', 0)})] --> B[{t['prisma_screened']}<br/>(n = {s.get('screened', 0)})]
-    B --> C[{t['prisma_excluded']}<br/>(n = {s.get('excluded', 0)})]
-    B --> D[{t['prisma_sought']}<br/>(n = {s.get('included', 0)})]
-    D --> E[{t['prisma_not_retrieved']}<br/>(n = {s.get('included', 0) - s.get('retrieved', 0)})]
-    D --> F[{t['prisma_retrieved']}<br/>(n = {s.get('retrieved', 0)})]
-    F --> G[{t['prisma_included']}<br/>(n = {s.get('retrieved', 0)})]
-```
-"""
-    return mermaid_code
+    template = _PRISMA_TEMPLATES.get(lang, _PRISMA_TEMPLATES["EN"])
+    included = s.get('included', 0)
+    retrieved = s.get('retrieved', 0)
+    return template.substitute(
+        total_found=s.get('total_found', 0),
+        screened=s.get('screened', 0),
+        excluded=s.get('excluded', 0),
+        included=included,
+        not_retrieved=included - retrieved,
+        retrieved=retrieved,
+    )
+
+def _markdown_cell(value):
+    # Pipes would split the cell and newlines would end the table row
+    return value.replace('|', '\\|').replace('\r', ' ').replace('\n', ' ')
 
-def generate_report(stats, picos, extracted_csv_path, rob_csv_path, output_path, lang="EN"):
+def _csv_table(path, t, full=False):
+    """
+    Returns (row count, Markdown table) for a result CSV.
+
+    Unless `full` is set, the file is streamed with csv.reader: every row is counted but only
+    the first REPORT_PREVIEW_ROWS are rendered, so the table is never loaded as a whole.
+    """
+    if full:
+        import pandas as pd # to_markdown also needs the optional tabulate package
+        df = pd.read_csv(path)
+        return len(df), df.to_markdown(index=False)
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return 0, ''
+        lines = [
+            '| ' + ' | '.join(map(_markdown_cell, header)) + ' |',
+            '|' + '|'.join('---' for _ in header) + '|',
+        ]
+        count = 0
+        for row in reader:
+            if not row: # Blank line
+                continue
+            if count < REPORT_PREVIEW_ROWS:
+                lines.append('| ' + ' | '.join(map(_markdown_cell, row)) + ' |')
+            count += 1
+
+    if count > REPORT_PREVIEW_ROWS:
+        lines.append('')
+        lines.append(t['table_truncated'].format(shown=REPORT_PREVIEW_ROWS, count=count, file=os.path.basename(path)))
+    return count, '\n'.join(lines)
+
+def generate_report(stats, picos, extracted_csv_path, rob_csv_path, output_path, lang="EN", full_tables=False):
     """
     Generates a comprehensive Markdown report.
+
+    The extraction and RoB tables show their first REPORT_PREVIEW_ROWS rows; pass
+    full_tables=True to render them completely (requires the tabulate package).
     """
     print(f"\n--- Generating Final Report ({lang}) ---")
     
     t = REPORT_TRANSLATIONS.get(lang, REPORT_TRANSLATIONS["EN"])
     
+    # The report is assembled in memory and written with a single call
+    parts = []
+
+    # Title and Header
+    parts.append(f"# {t['title']}\n")
+    parts.append(f"**{t['date']}:** {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n")
+    
+    # PICO Configuration
+    parts.append(f"## {t['pico_header']}\n")
+    if picos:
+        parts.extend(f"- **{k.capitalize()}:** {v}\n" for k, v in picos.items())
+    parts.append("\n")
+    
+    # PRISMA Flow
+    parts.append(f"## {t['prisma_header']}\n")
+    parts.append(generate_prisma_mermaid(stats, lang=lang))
+    parts.append("\n")
+    
+    # Statistics Summary
+    parts.append(
+        f"## {t['stats_header']}\n"
+        f"- {t['stat_total']}: {stats.get('total_found', 0)}\n"
+        f"- {t['stat_screened']}: {stats.get('screened', 0)}\n"
+        f"- {t['stat_excluded']}: {stats.get('excluded', 0)}\n"
+        f"- {t['stat_included']}: {stats.get('included', 0)}\n"
+        f"- {t['stat_retrieved']}: {stats.get('retrieved', 0)}\n"
+        "\n"
+    )
+    
+    # Extracted Data Summary
+    parts.append(f"## {t['extract_header']}\n")
+    if os.path.exists(extracted_csv_path):
+        count, table = _csv_table(extracted_csv_path, t, full=full_tables)
+        parts.append(f"{t['extract_count']}: {count}\n\n")
+        parts.append(table)
+    else:
+        parts.append(f"{t['no_extract']}\n")
+    parts.append("\n\n")
+
+    # RoB Summary
+    parts.append(f"## {t['rob_header']}\n")
+    if os.path.exists(rob_csv_path):
+        count, table = _csv_table(rob_csv_path, t, full=full_tables)
+        parts.append(f"{t['rob_count'].format(count=count)}\n\n")
+        parts.append(table)
+    else:
+        parts.append(f"{t['no_rob']}\n")
+    parts.append("\n")
+
     with open(output_path, 'w', encoding='utf-8') as f:
-        # Title and Header
-        f.write(f"# {t['title']}\n")
-        f.write(f"**{t['date']}:** {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n")
-        
-        # PICO Configuration
-        f.write(f"## {t['pico_header']}\n")
-        if picos:
-            for k, v in picos.items():
-                f.write(f"- **{k.capitalize()}:** {v}\n")
-        f.write("\n")
-        
-        # PRISMA Flow
-        f.write(f"## {t['prisma_header']}\n")
-        f.write(generate_prisma_mermaid(stats, lang=lang))
-        f.write("\n")
-        
-        # Statistics Summary
-        f.write(f"## {t['stats_header']}\n")
-        f.write(f"- {t['stat_total']}: {stats.get('total_found', 0)}\n")
-        f.write(f"- {t['stat_screened']}: {stats.get('screened', 0)}\n")
-        f.write(f"- {t['stat_excluded']}: {stats.get('excluded', 0)}\n")
-        f.write(f"- {t['stat_included']}: {stats.get('included', 0)}\n")
-        f.write(f"- {t['stat_retrieved']}: {stats.get('retrieved', 0)}\n")
-        f.write("\n")
-        
-        # Extracted Data Summary
-        f.write(f"## {t['extract_header']}\n")
-        if os.path.exists(extracted_csv_path):
-            df = pd.read_csv(extracted_csv_path)
-            f.write(f"{t['extract_count']}: {len(df)}\n\n")
-            f.write(df.to_markdown(index=False))
-        else:
-            f.write(f"{t['no_extract']}\n")
-        f.write("\n\n")
-
-        # RoB Summary
-        f.write(f"## {t['rob_header']}\n")
-        if os.path.exists(rob_csv_path):
-            rob_df = pd.read_csv(rob_csv_path)
-            f.write(f"{t['rob_count'].format(count=len(rob_df))}\n\n")
-            f.write(rob_df.to_markdown(index=False))
-        else:
-            f.write(f"{t['no_rob']}\n")
-        f.write("\n")
+        f.write(''.join(parts))
 
     print(f"Report saved to {output_path}")
 
@@ -1,23 +1,45 @@
-import pandas as pd
-import json
-import re
+import csv
+import orjson
 import os
+from concurrent.futures import ThreadPoolExecutor
 from src.llm import client as llm_client
 from src.parse import tei_parser
 
-def assess_risk_of_bias(tei_path):
+# Bounds per assessment call: five domains with explanations fit well within the token cap,
+# and the timeout leaves room for a local model reading ~12k characters of full text
+ROB_MAX_TOKENS = 1024
+ROB_TIMEOUT = 180 # Seconds
+ROB_MAX_RETRIES = 3
+ROB_TEXT_TOKENS = 3000 # Full-text budget per prompt; about the former 12k-character cut for English
+
+# Reply keys the model is told to use; they fix the CSV header, so rows can be written as
+# each assessment arrives
+ROB_DOMAINS = ("Randomization", "Deviations", "Missing Data", "Measurement", "Reporting")
+ROB_FIELDS = ('pmid',) + tuple(f"{domain}_{part}" for domain in ROB_DOMAINS for part in ("Level", "Explanation"))
+
+def _domain_key(key):
+    """Case, spacing and '_'/'-' variants of a domain name all map to the same key."""
+    return ' '.join(str(key).replace('_', ' ').replace('-', ' ').split()).casefold()
+
+_DOMAIN_BY_KEY = {_domain_key(domain): domain for domain in ROB_DOMAINS}
+
+def assess_risk_of_bias(tei_path, llm=None):
     """
     Assess Risk of Bias for a single article using its TEI XML.
+    `llm` lets a batch share one client (and its connection pool); one is created if omitted.
     Returns the assessment as a dictionary.
     """
-    llm = llm_client.LLMClient()
+    if llm is None:
+        llm = llm_client.LLMClient(cache_dir=llm_client.LLM_CACHE_DIR)
     
     full_text = tei_parser.extract_text_from_tei(tei_path)
     if not full_text:
         return None
 
-    # Limit text length to avoid token limits (approx 10k chars)
-    text_snippet = (full_text[:12000] + '...') if len(full_text) > 12000 else full_text
+    # Limit text length to avoid token limits
+    text_snippet, truncated = llm_client.truncate_to_tokens(full_text, ROB_TEXT_TOKENS)
+    if truncated:
+        text_snippet += '...'
 
     system_prompt = """You are an expert in Cochrane Risk of Bias assessment tool (RoB 2) and ROBINS-I.
 Analyze the provided research paper text and assess the risk of bias for the following domains:
@@ -31,7 +53,8 @@ For each domain, determine the risk level: "Low", "High", or "Unclear/Some Conce
 Provide a brief explanation for your judgment.
 
 Output Format:
-JSON object with keys as domain names (e.g., "Randomization") and values as an object {"level": "...", "explanation": "..."}.
+JSON object with exactly these keys, one per domain in the order above: """ + ", ".join(f'"{domain}"' for domain in ROB_DOMAINS) + """.
+Each value is an object {"level": "...", "explanation": "..."}.
 Example:
 {
   "Randomization": {"level": "Low", "explanation": "The study mentions computer-generated random numbers."},
@@ -52,57 +75,109 @@ Assess the Risk of Bias. Return JSON.
     ]
 
     try:
-        response = llm.get_completion(messages)
+        response = llm.get_completion(messages, max_tokens=ROB_MAX_TOKENS, timeout=ROB_TIMEOUT, max_retries=ROB_MAX_RETRIES,
+                                      response_format=llm_client.JSON_OBJECT)
         if response:
-             # Basic regex to catch json blocks or just the curlies
-             match = re.search(r"({[\s\S]*})", response)
-             if match:
-                 return json.loads(match.group(1))
+             # The outermost {...} span: first '{' to last '}', found without a regex scan
+             start, end = response.find('{'), response.rfind('}')
+             if start != -1 and end > start:
+                 return orjson.loads(response[start:end + 1])
     except Exception as e:
         print(f"Error evaluating RoB: {e}")
     
     return None
 
+def _assessed_pmids(output_csv_path):
+    """PMIDs already in a results CSV with the current header, or None if it cannot be resumed."""
+    try:
+        with open(output_csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            if tuple(next(reader, ())) != ROB_FIELDS:
+                return None
+            return {row[0] for row in reader if row}
+    except FileNotFoundError:
+        return None
+
 def batch_assess_rob(tei_dir, output_csv_path):
     """
     Runs RoB assessment for all XML files in the TEI directory.
-    Saves results to a CSV file.
+    Each result row is appended to the CSV file as soon as it is available, and articles
+    already in an existing file are skipped, so an interrupted run resumes where it stopped.
+
+    Returns:
+        int: The number of rows in the CSV file (including rows kept from a resumed run),
+             or None if there were no TEI files or no article could be assessed. The rows
+             themselves are not returned (earlier versions returned a DataFrame); read
+             output_csv_path for them.
     """
     print("\n--- Starting Automated Risk of Bias (RoB) Assessment ---")
     
-    rob_results = []
-    
-    tei_files = [f for f in os.listdir(tei_dir) if f.endswith('.xml')]
+    # scandir entries carry their full path, so no per-file join is needed
+    with os.scandir(tei_dir) as entries:
+        tei_files = [entry for entry in entries if entry.name.endswith('.xml')]
     if not tei_files:
         print("No TEI files found for RoB assessment.")
-        return
-
-    for tei_file in tei_files:
-        pmid = tei_file.replace('.xml', '')
-        tei_path = os.path.join(tei_dir, tei_file)
-        
-        print(f"Assess RoB for PMID: {pmid}...", end="\r")
-        
-        assessment = assess_risk_of_bias(tei_path)
-        
-        if assessment:
+        return None
+
+    done = _assessed_pmids(output_csv_path)
+    if done:
+        tei_files = [entry for entry in tei_files if entry.name.removesuffix('.xml') not in done]
+        print(f"Resuming: {len(done)} articles already assessed in {output_csv_path}")
+    written = len(done or ())
+
+    # Each article mostly waits on the LLM server, so several are assessed at once;
+    # executor.map keeps the results in file order
+    llm = llm_client.LLMClient(cache_dir=llm_client.LLM_CACHE_DIR)
+    print(f"Assessing RoB for {len(tei_files)} articles...")
+    with open(output_csv_path, 'w' if done is None else 'a', encoding='utf-8-sig', newline='') as f, \
+         ThreadPoolExecutor(max_workers=llm_client.LLM_CONCURRENCY) as executor:
+        # Domains the model adds beyond ROB_DOMAINS are dropped (and reported); missing ones are left empty
+        writer = csv.DictWriter(f, fieldnames=ROB_FIELDS, restval='')
+        if done is None:
+            writer.writeheader()
+        assessments = executor.map(
+            lambda tei_file: assess_risk_of_bias(tei_file.path, llm), tei_files
+        )
+
+        for tei_file, assessment in zip(tei_files, assessments):
+            pmid = tei_file.name.removesuffix('.xml')
+
+            # Reply keys are matched to ROB_DOMAINS ignoring case and spacing, as small models
+            # vary them; the first key for a domain wins. A reply matching none of them (e.g. the
+            # long domain names) would be an empty row that resume then skips for good, so it is
+            # a failure and retried next run
+            matched = {}
+            for key in assessment if isinstance(assessment, dict) else ():
+                domain = _DOMAIN_BY_KEY.get(_domain_key(key))
+                if domain and domain not in matched:
+                    matched[domain] = key
+            if not matched:
+                if assessment:
+                    print(f"Failed to assess RoB for {pmid}: reply has none of the domains {ROB_DOMAINS}: {list(assessment)}")
+                else:
+                    print(f"Failed to assess RoB for {pmid}")
+                continue
+            dropped = [key for key in assessment if key not in matched.values()]
+            if dropped:
+                print(f"RoB for {pmid}: ignoring unexpected domains {dropped}")
+
             flat_result = {'pmid': pmid}
-            for domain, details in assessment.items():
+            for domain, key in matched.items():
+                details = assessment[key]
                 if isinstance(details, dict):
                     flat_result[f"{domain}_Level"] = details.get('level', 'Unclear')
                     flat_result[f"{domain}_Explanation"] = details.get('explanation', '')
                 else:
-                    # Fallback if structure is flat or weird
-                    flat_result[domain] = str(details)
-            rob_results.append(flat_result)
-        else:
-            print(f"Failed to assess RoB for {pmid}")
-
-    if rob_results:
-        df = pd.DataFrame(rob_results)
-        df.to_csv(output_csv_path, index=False, encoding='utf-8-sig')
+                    # Fallback if structure is flat: the value is taken as the level
+                    flat_result[f"{domain}_Level"] = str(details)
+            writer.writerow(flat_result)
+            f.flush() # Completed rows survive an interrupted run
+            written += 1
+
+    if written:
         print(f"\nSaved RoB assessment results to {output_csv_path}")
-        return df
+        return written
     else:
+        os.remove(output_csv_path) # Only a header; the report treats a missing file as no RoB data
         print("\nNo RoB results generated.")
         return None
@@ -1,9 +1,43 @@
-import pandas as pd
-import os
-import json
-import re
+import orjson
 from src.llm import client as llm_client
 
+# Bounds per screening call: the reply is a short JSON object, and one stuck request must
+# not hold up the batch
+SCREENING_MAX_TOKENS = 256
+SCREENING_TIMEOUT = 60 # Seconds
+SCREENING_MAX_RETRIES = 3
+SCREENING_BATCH_SIZE = 10 # Most papers per request; SCREENING_MAX_TOKENS is budgeted per paper
+# Most title+abstract tokens per grouped request. Ollama's default context is 2k-4k tokens and
+# an overlong prompt is cut silently, losing papers, so a group is closed before it gets there
+SCREENING_GROUP_TOKENS = 1200
+
+SINGLE_OUTPUT_FORMAT = """
+Output Format:
+Provide your response in JSON format with two keys:
+1. "decision": String, either "Included" or "Excluded".
+2. "reason": A brief explanation (1-2 sentences) citing specific criteria matched or missed.
+"""
+
+GROUP_OUTPUT_FORMAT = """
+Output Format:
+Several numbered papers are given. Provide your response in JSON format with one key,
+"results": a list with one object per paper, each with three keys:
+1. "id": Integer, the paper's number as given in brackets.
+2. "decision": String, either "Included" or "Excluded".
+3. "reason": A brief explanation (1-2 sentences) citing specific criteria matched or missed.
+"""
+
+def _json_object(response):
+    """The outermost {...} span of a reply, parsed; None if the reply has no braces."""
+    # First '{' to last '}', found without a regex scan
+    start, end = response.find('{'), response.rfind('}')
+    if start != -1 and end > start:
+        return orjson.loads(response[start:end + 1])
+    return None
+
+def _normalize_decision(decision):
+    return "Excluded" if "exclude" in str(decision).lower() else "Included"
+
 def screen_abstracts(articles_df, picos_data):
     """
     Screens articles based on Title and Abstract using an LLM and PICO criteria.
@@ -17,25 +51,18 @@ def screen_abstracts(articles_df, picos_data):
     """
     print("\n--- Starting Automated Screening (Title/Abstract) ---")
     
-    llm = llm_client.LLMClient()
+    llm = llm_client.LLMClient(cache_dir=llm_client.LLM_CACHE_DIR)
     
-    # Check LLM connection
-    if not llm.get_completion([{"role": "user", "content": "Test"}]):
+    # Check LLM connection without spending a completion on it
+    if not llm.is_available():
         print("LLM not connected. Skipping automated screening. All articles will be marked as 'Included' (Manual Review Needed).")
-        articles_df['screening_decision'] = 'Included'
-        articles_df['screening_reason'] = 'LLM Unavailable'
-        return articles_df
+        return articles_df.assign(screening_decision='Included', screening_reason='LLM Unavailable')
 
     system_prompt = """You are an expert systematic reviewer. 
 Your task is to screen research papers based on their Title and Abstract to decide if they should be included in a systematic review.
 You will be provided with the PICO criteria (Population, Intervention, Comparison, Outcome) and Study Design.
 Compare the paper's content with these criteria.
 
-Output Format:
-Provide your response in JSON format with two keys:
-1. "decision": String, either "Included" or "Excluded".
-2. "reason": A brief explanation (1-2 sentences) citing specific criteria matched or missed.
-
 Criteria for Inclusion:
 - The paper MUST match the Population and Intervention.
 - It should ideally match the Study Design (if specified).
@@ -51,15 +78,75 @@ Criteria for Inclusion:
     Study Design: {picos_data.get('study_design', 'Any')}
     """
 
-    results = []
+    # Built once and shared by every request; the static system message comes first, so a
+    # server with prompt caching can reuse its prefill across requests
+    group_system_message = {"role": "system", "content": system_prompt + GROUP_OUTPUT_FORMAT}
+    single_system_message = {"role": "system", "content": system_prompt + SINGLE_OUTPUT_FORMAT}
 
-    for index, row in articles_df.iterrows():
-        pmid = row.get('pmid', 'Unknown')
-        title = row.get('title', 'No Title')
-        abstract = row.get('abstract', 'No Abstract')
-        
-        print(f"Screening PMID: {pmid}...", end="\r")
+    # Only the two prompt columns are read, as plain lists; no per-row tuple is built
+    papers = list(zip(articles_df['title'].tolist(), articles_df['abstract'].tolist()))
+    decisions = [None] * len(papers)
+    reasons = [None] * len(papers)
 
+    # Several papers share one request, so the instructions and PICO criteria are sent once
+    # per group rather than once per paper. A group is closed at SCREENING_BATCH_SIZE papers
+    # or SCREENING_GROUP_TOKENS tokens; a paper longer than that on its own forms its own group
+    groups = []
+    group, group_tokens = [], 0
+    for i, (title, abstract) in enumerate(papers):
+        tokens = llm_client.count_tokens(f"{title}\n{abstract}")
+        if group and (len(group) == SCREENING_BATCH_SIZE or group_tokens + tokens > SCREENING_GROUP_TOKENS):
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(i)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    group_batch = []
+    for group in groups:
+        papers_text = "\n".join(
+            f"[{position}]\nTitle: {papers[i][0]}\nAbstract: {papers[i][1]}\n"
+            for position, i in enumerate(group, 1)
+        )
+        user_prompt = f"""
+PICO Criteria:
+{pico_text}
+
+Papers to Screen:
+{papers_text}
+Screen each paper independently. Return JSON.
+"""
+        group_batch.append([
+            group_system_message,
+            {"role": "user", "content": user_prompt}
+        ])
+
+    print(f"Screening {len(papers)} articles in {len(groups)} requests...")
+    responses = llm.get_completions(
+        group_batch, return_exceptions=True,
+        max_tokens=SCREENING_MAX_TOKENS * SCREENING_BATCH_SIZE, timeout=SCREENING_TIMEOUT,
+        max_retries=SCREENING_MAX_RETRIES, response_format=llm_client.JSON_OBJECT,
+    )
+    for group, response in zip(groups, responses):
+        try:
+            results = _json_object(response).get("results") if isinstance(response, str) else None
+        except (orjson.JSONDecodeError, AttributeError):
+            results = None
+        for item in results if isinstance(results, list) else ():
+            position = item.get("id") if isinstance(item, dict) else None
+            if isinstance(position, int) and 1 <= position <= len(group):
+                i = group[position - 1]
+                decisions[i] = _normalize_decision(item.get("decision", "Included"))
+                reasons[i] = item.get("reason", "No reason provided")
+
+    # Papers a group reply missed (failed request, truncated or malformed JSON, skipped id)
+    # are re-submitted one per request
+    retry = [i for i, decision in enumerate(decisions) if decision is None]
+    if retry:
+        print(f"Re-screening {len(retry)} articles individually...")
+    batch = []
+    for i in retry:
+        title, abstract = papers[i]
         user_prompt = f"""
 PICO Criteria:
 {pico_text}
@@ -70,50 +157,50 @@ Abstract: {abstract}
 
 Is this paper relevant? Return JSON.
 """
-        messages = [
-            {"role": "system", "content": system_prompt},
+        batch.append([
+            single_system_message,
             {"role": "user", "content": user_prompt}
-        ]
+        ])
+
+    responses = llm.get_completions(
+        batch, return_exceptions=True,
+        max_tokens=SCREENING_MAX_TOKENS, timeout=SCREENING_TIMEOUT, max_retries=SCREENING_MAX_RETRIES,
+        response_format=llm_client.JSON_OBJECT,
+    ) if batch else []
 
+    for i, response in zip(retry, responses):
+        if isinstance(response, Exception):
+            decisions[i] = "Included"
+            reasons[i] = f"Error during screening: {str(response)}"
+            continue
         try:
-            response = llm.get_completion(messages)
             decision = "Included" # Default
             reason = "Parse Error"
 
             if response:
-                # cleaner regex to capture JSON block or just braces
-                json_match = re.search(r"({[\s\S]*})", response)
-                if json_match:
-                    try:
-                        data = json.loads(json_match.group(1))
+                try:
+                    data = _json_object(response)
+                    if data is not None:
                         decision = data.get("decision", "Included")
                         reason = data.get("reason", "No reason provided")
-                    except json.JSONDecodeError:
-                         reason = "JSON Decode Error"
-                else:
-                    reason = "No JSON found in response"
+                    else:
+                        reason = "No JSON found in response"
+                except orjson.JSONDecodeError:
+                     reason = "JSON Decode Error"
             else:
                 reason = "No response from LLM"
-            
-            # Normalize decision
-            if "exclude" in decision.lower():
-                decision = "Excluded"
-            else:
-                decision = "Included"
+
+            decision = _normalize_decision(decision)
 
         except Exception as e:
             decision = "Included"
             reason = f"Error during screening: {str(e)}"
 
-        results.append({'pmid': pmid, 'screening_decision': decision, 'screening_reason': reason})
+        decisions[i] = decision
+        reasons[i] = reason
 
     print(f"\nScreening complete. Processed {len(articles_df)} articles.")
     
-    # Merge results back to DataFrame
-    results_df = pd.DataFrame(results)
-    # Ensure pmid is same type for merge
-    articles_df['pmid'] = articles_df['pmid'].astype(str)
-    results_df['pmid'] = results_df['pmid'].astype(str)
-    
-    final_df = pd.merge(articles_df, results_df, on='pmid', how='left')
-    return final_df
+    # The replies are in row order, so the results are added as columns; no merge on pmid
+    # (which also duplicated rows whenever a PMID appeared twice), hence no pmid coercion either
+    return articles_df.assign(screening_decision=decisions, screening_reason=reasons)
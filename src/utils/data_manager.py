@@ -1,5 +1,6 @@
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Define file paths (these should ideally be passed or imported from a central config)
 # For now, let's define them here for self-containment, assuming project root context
@@ -7,17 +8,30 @@ DATA_DIR = "data"
 RAW_DATA_DIR = os.path.join(DATA_DIR, "raw")
 TABLES_DIR = os.path.join(DATA_DIR, "tables")
 PDF_DIR = os.path.join(DATA_DIR, "pdf")
+CACHE_DIR = os.path.join(DATA_DIR, ".cache") # PubMed EFetch, Unpaywall and LLM response caches
+DELETE_WORKERS = 16 # Unlinks in flight; each mostly waits on the filesystem
 
-def clear_generated_data_files():
+def _remove_file(path):
+    """Deletes one file; returns the error instead of raising, so one failure doesn't stop the rest."""
+    try:
+        os.remove(path)
+    except Exception as e:
+        return e
+    return None
+
+def clear_generated_data_files(clear_cache=True):
     """
     Deletes specific generated data files and contents of the PDF directory,
     preserving directory structure and non-generated files like readme.md.
+    The PubMed response cache is removed as well unless clear_cache is False.
     """
     print("이전 데이터를 삭제합니다...")
     files_to_delete = [
         os.path.join(RAW_DATA_DIR, "articles.xml"),
         os.path.join(TABLES_DIR, "retrieved_pmids.csv"),
-        os.path.join(TABLES_DIR, "articles.csv")
+        os.path.join(TABLES_DIR, "articles.csv"),
+        # batch_assess_rob resumes from an existing file, so a new search must not inherit it
+        os.path.join(TABLES_DIR, "rob_assessment.csv")
     ]
 
     for f in files_to_delete:
@@ -29,14 +43,25 @@ def clear_generated_data_files():
                 print(f"오류: {f} 삭제 실패. {e}")
 
     if os.path.exists(PDF_DIR):
-        for item in os.listdir(PDF_DIR):
-            item_path = os.path.join(PDF_DIR, item)
-            if os.path.isfile(item_path) and item.lower().endswith('.pdf'): # Only delete PDFs
-                try:
-                    os.remove(item_path)
-                    print(f" - 삭제됨: {item_path}")
-                except Exception as e:
-                    print(f"오류: {item_path} 삭제 실패. {e}")
+        # scandir entries carry their path and file type, so no join or extra stat per file
+        with os.scandir(PDF_DIR) as entries:
+            pdf_paths = [entry.path for entry in entries
+                         if entry.is_file() and entry.name.lower().endswith('.pdf')] # Only delete PDFs
+        # os.remove releases the GIL, so the unlinks overlap; one summary line instead of one per file
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            errors = list(executor.map(_remove_file, pdf_paths))
+        for path, e in zip(pdf_paths, errors):
+            if e is not None:
+                print(f"오류: {path} 삭제 실패. {e}")
+        if pdf_paths:
+            print(f" - 삭제됨: {PDF_DIR} 안의 PDF {errors.count(None)}개")
+    
+    if clear_cache and os.path.isdir(CACHE_DIR):
+        try:
+            shutil.rmtree(CACHE_DIR)
+            print(f" - 삭제됨: {CACHE_DIR}")
+        except Exception as e:
+            print(f"오류: {CACHE_DIR} 삭제 실패. {e}")
     
     print("이전 데이터 파일 삭제 완료.")
     return True
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("lxml")
+
+from src.parse import tei_parser
+
+TEI = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+  <teiHeader><fileDesc><titleStmt><title>Header title</title></titleStmt></fileDesc></teiHeader>
+  <text>
+    <body>Lead text
+      <div><head>Methods</head>
+        <p>Patients were randomised.</p></div>
+      <!-- GROBID comment -->after the comment
+      <?grobid note?>after the instruction
+      <div><head>Results</head>
+        <p>Outcomes improved.</p></div>
+      tail of the last section
+    </body>
+    <back><div><p>Reference list</p></div></back>
+  </text>
+</TEI>
+"""
+
+def test_extract_text_keeps_text_after_comments_and_pis(tmp_path):
+    path = tmp_path / "article.xml"
+    path.write_text(TEI, encoding="utf-8")
+
+    assert tei_parser.extract_text_from_tei(str(path)) == (
+        "Lead text Methods Patients were randomised. after the comment after the instruction "
+        "Results Outcomes improved. tail of the last section"
+    )